@@ -2,11 +2,22 @@ import streamlit as st
 from streamlit.components.v1 import html
 import requests
 import json
+import hashlib
+import io
+import math
+import wave
 import boto3
+import numpy as np
+from scipy.signal import resample_poly
 import uuid
 import os
+import random
+import threading
 import time
 import datetime as dt
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 from dotenv import load_dotenv
 from typing import Any, Dict, Optional
 
@@ -14,8 +25,27 @@ from typing import Any, Dict, Optional
 APP_TITLE = "After Words, the words of the here after."
 LAMBDA_BASE = "https://ape2rb6shmlwbcvtchqvhaenai0pjfsr.lambda-url.us-east-2.on.aws"
 LAMBDA_TTS = f"{LAMBDA_BASE}/tts"
+LAMBDA_TTS_STREAM = f"{LAMBDA_BASE}/tts/stream"
+LAMBDA_TTS_BATCH = f"{LAMBDA_BASE}/tts/batch"
+LAMBDA_CLONE = f"{LAMBDA_BASE}/clone"
+# Upload and clone as soon as a sample is selected, before Start Chat
+SPECULATIVE_CLONE = os.getenv("SPECULATIVE_CLONE", "1") == "1"
+# Play replies in the browser while they are generated (GET /tts/stream)
+USE_TTS_STREAM = os.getenv("USE_TTS_STREAM", "1") == "1"
+# Retries when the API is busy (503) or an upstream quota is hit (429)
+API_RETRIES = 3
+API_RETRY_DELAY = 1.0  # seconds, doubled per attempt unless Retry-After says otherwise
+# Most texts per /tts/batch request; keep within the API's BATCH_MAX_ITEMS
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 20))
+# Show the API's per-stage timings (Server-Timing) under each reply
+SHOW_TIMINGS = os.getenv("SHOW_TIMINGS", "0") == "1"
 
 S3_BUCKET = "after_words-wavs"
+# Reply audio encoding requested from the API ("mp3" | "opus") and bitrate in kbps
+REPLY_FORMAT = os.getenv("REPLY_FORMAT", "mp3")
+REPLY_BITRATE = int(os.getenv("REPLY_BITRATE", 64))
+# Player format by S3 key extension; older sessions stored replies as .wav
+AUDIO_MIME = {"mp3": "audio/mpeg", "ogg": "audio/ogg", "wav": "audio/wav"}
 REGION = os.getenv("AWS_REGION", "us-east-2")
 
 # EventBridge Scheduler config (server-side cleanup)
@@ -27,9 +57,35 @@ CLEANUP_LAMBDA_ARN = os.getenv(
     "CLEANUP_LAMBDA_ARN"
 )  # arn:aws:lambda:us-east-2:...:function:lambda_cleanup
 DEFAULT_TTL = 600  # 10 minutes
+# "sweeper": the cleanup Lambda's periodic sweep finds expired leases itself.
+# "schedule": one EventBridge schedule per session (legacy).
+CLEANUP_MODE = os.getenv("CLEANUP_MODE", "sweeper")
+
+# History playback: presigned S3 URLs
+PRESIGN_TTL = 3600
+PRESIGN_MARGIN = 120  # re-sign URLs this close to expiry
+
+# Voice sample ingest: mono, resampled, silence-trimmed and capped before upload
+SAMPLE_RATE = int(os.getenv("SAMPLE_RATE", 22050))  # only ever downsampled
+SAMPLE_MAX_SECONDS = float(os.getenv("SAMPLE_MAX_SECONDS", 120))
+SILENCE_DB = -40.0  # frames this far below the peak count as silence
+SILENCE_PAD = 0.2  # seconds of silence kept around the speech
 
 # DynamoDB table (reusing your existing "leases" table)
 LEASES_TABLE = os.getenv("LEASES_TABLE", "leases")
+# Lease reads are reused this long (seconds) per session id; our own writes
+# invalidate them. Writes are conditional on the lease's version number.
+LEASE_CACHE_TTL = int(os.getenv("LEASE_CACHE_TTL", 15))
+LEASE_CACHE_MAX = 1024
+LEASE_WRITE_ATTEMPTS = 3
+LEASE_WRITE_TIMEOUT = 30  # seconds to wait for Start Chat's background lease write
+# One item per chat turn (PK session_id, SK turn), so each turn costs one small write
+CHAT_TURNS_TABLE = os.getenv("CHAT_TURNS_TABLE", "chat_turns")
+TURN_RETENTION = 3600  # keep turns this long past the session expiry
+TURN_WRITE_ATTEMPTS = 5  # next indexes tried when another tab took a turn
+
+# Writes that don't gate the UI (lease, turns, schedules) run on a shared pool
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", 8))
 
 # ================= Streamlit app config =================
 st.set_page_config(layout="centered", page_title=APP_TITLE)
@@ -53,6 +109,7 @@ sch = boto3.client(
 )
 ddb = boto3.resource("dynamodb", region_name=REGION)
 leases_tbl = ddb.Table(LEASES_TABLE)
+turns_tbl = ddb.Table(CHAT_TURNS_TABLE)
 
 
 # ================= URL session id (sid) =================
@@ -75,6 +132,20 @@ SID = get_or_create_sid()
 
 
 # ================= Helpers: DynamoDB (leases) =================
+@st.cache_resource
+def lease_cache():
+    """(lock, {session_id: (lease, read_at)}), shared by every browser session."""
+    return threading.Lock(), {}
+
+
+LEASE_LOCK, LEASE_CACHE = lease_cache()
+
+
+def forget_lease(session_id: str):
+    with LEASE_LOCK:
+        LEASE_CACHE.pop(session_id, None)
+
+
 def put_lease_item(
     session_id: str,
     voice_id: Optional[str],
@@ -82,38 +153,62 @@ def put_lease_item(
     rs: str,
     lang: str,
     audio_key: str,
-    chat_log: list,
     started_at: int,
     expires_at: int,
     status: str = "active",
+    sample_sha256: Optional[str] = None,
+    sample_sizes: Optional[Dict[str, int]] = None,
 ):
     item = {
         "session_id": session_id,  # PK
         "el_voice_id": voice_id,  # voice id at this moment
         "started_at_epoch": int(started_at),
         "expires_at_epoch": int(expires_at),
-        "status": status,  # "active" | "ended" | "expired"
+        "status": status,  # "speculative" | "active" | "ended" | "expired"
         # Extra (schemaless)
         "who": who,
         "rs": rs,
         "lang": lang,
         "audio_key": audio_key,
-        "chat_log": chat_log,
+        # lets cleanup release a voice shared with other sessions (same sample)
+        "sample_sha256": sample_sha256,
     }
+    if sample_sizes:
+        item.update(sample_sizes)  # sample_bytes_original / sample_bytes
+    item["version"] = 1  # bumped by every update_lease_fields
     leases_tbl.put_item(Item=item)
+    forget_lease(session_id)
 
 
-def get_lease(session_id: str) -> Dict[str, Any]:
+def get_lease(session_id: str, fresh: bool = False) -> Dict[str, Any]:
+    """
+    The lease row, reused for LEASE_CACHE_TTL seconds unless `fresh`, so
+    reruns on an ended session don't read DynamoDB every time.
+    """
+    now = time.time()
+    with LEASE_LOCK:
+        cached = LEASE_CACHE.get(session_id)
+    if cached and not fresh and now - cached[1] < LEASE_CACHE_TTL:
+        return cached[0]
     resp = leases_tbl.get_item(Key={"session_id": session_id})
-    return resp.get("Item", {}) or {}
+    lease = resp.get("Item", {}) or {}
+    with LEASE_LOCK:
+        LEASE_CACHE[session_id] = (lease, now)
+        while len(LEASE_CACHE) > LEASE_CACHE_MAX:
+            LEASE_CACHE.pop(next(iter(LEASE_CACHE)))
+    return lease
 
 
-def update_lease_fields(session_id: str, fields: Dict[str, Any]):
+def update_lease_fields(
+    session_id: str, fields: Dict[str, Any], version: int
+) -> Optional[int]:
     """
-    Generic SET update for arbitrary fields.
+    Generic SET update for arbitrary fields, applied only if the lease exists
+    and is still at `version` (leases written before versioning count as 0).
+    Returns the new version, or None if the lease changed in the meantime.
     """
     if not fields:
-        return
+        return version
     # Build UpdateExpression dynamically
     names = {}
     values = {}
@@ -124,23 +219,299 @@ def update_lease_fields(session_id: str, fields: Dict[str, Any]):
         names[nk] = k
         values[vk] = v
         sets.append(f"{nk} = {vk}")
+    names["#ver"] = "version"
+    values[":ver"] = version
+    values[":next"] = version + 1
+    sets.append("#ver = :next")
     expr = "SET " + ", ".join(sets)
-    leases_tbl.update_item(
-        Key={"session_id": session_id},
-        UpdateExpression=expr,
-        ExpressionAttributeNames=names,
-        ExpressionAttributeValues=values,
+    cond = "attribute_exists(session_id) AND " + (
+        "(attribute_not_exists(#ver) OR #ver = :ver)" if version == 0 else "#ver = :ver"
     )
+    try:
+        leases_tbl.update_item(
+            Key={"session_id": session_id},
+            UpdateExpression=expr,
+            ConditionExpression=cond,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return None
+    finally:
+        forget_lease(session_id)
+    return version + 1
+
+
+def save_lease_fields(fields: Dict[str, Any]) -> bool:
+    """
+    Versioned update of this session's lease. If another tab wrote it first,
+    re-read it and apply the change on top of the new version, unless that
+    tab has ended the session (only the status itself may still be set).
+    A change that can't be saved is shown as a warning.
+    """
+    session_id = st.session_state.session_id
+    pending = st.session_state.lease_write
+    if pending is not None:
+        # Start Chat writes the lease in the background; update on top of it
+        try:
+            pending.result(timeout=LEASE_WRITE_TIMEOUT)
+        except Exception:
+            pass  # report_background() shows the failure
+        st.session_state.lease_write = None
+    for _ in range(LEASE_WRITE_ATTEMPTS):
+        version = update_lease_fields(
+            session_id, fields, st.session_state.lease_version
+        )
+        if version is not None:
+            st.session_state.lease_version = version
+            return True
+        lease = get_lease(session_id, fresh=True)
+        if not lease or (lease.get("status") != "active" and "status" not in fields):
+            break
+        st.session_state.lease_version = int(lease.get("version", 0))
+    st.warning(
+        f"⚠️ Couldn't save {', '.join(fields)} to the session lease; "
+        "cleanup may not find this session's voice."
+    )
+    return False
 
 
-def mark_lease_status(session_id: str, new_status: str):
-    update_lease_fields(session_id, {"status": new_status})
+# ================= Helpers: DynamoDB (chat turns) =================
+def _turn_item(session_id: str, turn: int, entry: Dict[str, str], expires_at: int):
+    return {
+        "session_id": session_id,  # PK
+        "turn": int(turn),  # SK
+        "user": entry["user"],
+        "bot": entry["bot"],
+        "created_at_epoch": int(time.time()),
+        "expires_at_epoch": int(expires_at) + TURN_RETENTION,  # table TTL
+    }
+
+
+def put_turn(session_id: str, turn: int, entry: Dict[str, str], expires_at: int) -> int:
+    """
+    Append one turn; the cost is constant however long the session runs.
+    An existing turn is never replaced: if another tab of the same session
+    wrote `turn` first, the next index is tried. Returns the index written.
+    """
+    for index in range(turn, turn + TURN_WRITE_ATTEMPTS):
+        try:
+            turns_tbl.put_item(
+                Item=_turn_item(session_id, index, entry, expires_at),
+                ConditionExpression="attribute_not_exists(#t)",
+                ExpressionAttributeNames={"#t": "turn"},
+            )
+            return index
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+    raise RuntimeError(f"No free turn index from {turn} for session {session_id}")
+
+
+def put_turns(session_id: str, first_turn: int, entries: list, expires_at: int) -> bool:
+    """
+    Append consecutive turns through put_turn, so none replaces a turn another
+    tab wrote. Returns False if some turn had to move to a later index.
+    """
+    turn, in_place = first_turn, True
+    for entry in entries:
+        written = put_turn(session_id, turn, entry, expires_at)
+        in_place = in_place and written == turn
+        turn = written + 1
+    return in_place
+
+
+def load_turns(session_id: str) -> list:
+    """All turns of a session in order, following query pagination."""
+    turns = []
+    kwargs = {
+        "KeyConditionExpression": "session_id = :sid",
+        "ExpressionAttributeValues": {":sid": session_id},
+        "ScanIndexForward": True,
+    }
+    while True:
+        resp = turns_tbl.query(**kwargs)
+        turns.extend({"user": i["user"], "bot": i["bot"]} for i in resp["Items"])
+        if "LastEvaluatedKey" not in resp:
+            return turns
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+# ================= Helpers: voice sample ingest =================
+def _pcm_to_float(frames: bytes, width: int) -> np.ndarray:
+    if width == 1:
+        return (np.frombuffer(frames, np.uint8).astype(np.float32) - 128) / 128
+    if width == 3:  # 24-bit little endian: widen to int32
+        raw = np.frombuffer(frames, np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(raw), 4), np.uint8)
+        padded[:, 1:] = raw
+        return padded.view("<i4").ravel().astype(np.float32) / 2**31
+    dtype = {2: "<i2", 4: "<i4"}[width]
+    return np.frombuffer(frames, dtype).astype(np.float32) / 2 ** (8 * width - 1)
+
+
+def prepare_sample(raw: bytes):
+    """
+    Reduce an uploaded wav to what voice cloning needs: mono, at most
+    SAMPLE_RATE Hz, leading/trailing silence trimmed and capped at
+    SAMPLE_MAX_SECONDS, written back as 16-bit PCM.
+    Returns (wav bytes, sizes); files that aren't plain PCM wav pass through.
+    """
+    try:
+        with wave.open(io.BytesIO(raw)) as w:
+            channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+            frames = w.readframes(w.getnframes())
+        audio = _pcm_to_float(frames, width)
+    except (wave.Error, EOFError, KeyError, ValueError):
+        return raw, {"sample_bytes_original": len(raw), "sample_bytes": len(raw)}
+
+    audio = audio[: len(audio) - len(audio) % channels].reshape(-1, channels).mean(axis=1)
+
+    # Trim silence on 20 ms windows, relative to the loudest window
+    win = max(1, rate // 50)
+    n = len(audio) // win
+    if n:
+        rms = np.sqrt((audio[: n * win].reshape(n, win) ** 2).mean(axis=1))
+        loud = np.flatnonzero(rms > rms.max() * 10 ** (SILENCE_DB / 20))
+        if len(loud):
+            pad = int(SILENCE_PAD * rate)
+            audio = audio[max(0, loud[0] * win - pad) : (loud[-1] + 1) * win + pad]
+
+    audio = audio[: int(SAMPLE_MAX_SECONDS * rate)]
+    if rate > SAMPLE_RATE:
+        # Polyphase resampling low-passes first, so nothing above the new
+        # Nyquist frequency aliases into the sample
+        g = math.gcd(SAMPLE_RATE, rate)
+        audio = resample_poly(audio, SAMPLE_RATE // g, rate // g)
+        rate = SAMPLE_RATE
+
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes((np.clip(audio, -1, 1) * 32767).astype("<i2").tobytes())
+    reduced = out.getvalue()
+    if len(reduced) >= len(raw):
+        # e.g. short 8-bit input, which grows when re-encoded as 16-bit
+        reduced = raw
+    return reduced, {"sample_bytes_original": len(raw), "sample_bytes": len(reduced)}
 
 
 # ================= Local UI helpers =================
-def fetch_audio_bytes(key: str) -> bytes:
-    obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
-    return obj["Body"].read()
+def audio_source(key: str):
+    """
+    What to hand to st.audio for a reply: a presigned URL so the browser
+    fetches the audio from S3 directly. URLs are reused until close to expiry
+    so reruns don't make the player reload.
+    """
+    urls = st.session_state.audio_urls
+    cached = urls.get(key)
+    if cached and cached[1] - time.time() > PRESIGN_MARGIN:
+        return cached[0]
+    url = s3.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": S3_BUCKET, "Key": key},
+        ExpiresIn=PRESIGN_TTL,
+    )
+    urls[key] = (url, time.time() + PRESIGN_TTL)
+    return url
+
+
+def audio_mime(key: str) -> str:
+    return AUDIO_MIME.get(key.rsplit(".", 1)[-1].lower(), "audio/wav")
+
+
+def post_api(url: str, payload: dict, timeout: int = 60, **kwargs):
+    """
+    POST a payload to the API. 429 (upstream quota) and 503 (server busy)
+    are retried after the server's Retry-After or a jittered backoff; the last
+    response is returned either way.
+    """
+    for attempt in range(1, API_RETRIES + 1):
+        r = requests.post(
+            url, data={"data": json.dumps(payload)}, timeout=timeout, **kwargs
+        )
+        if r.status_code not in (429, 503) or attempt == API_RETRIES:
+            return r
+        try:
+            delay = float(r.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            delay = API_RETRY_DELAY * 2 ** (attempt - 1)
+        r.close()
+        time.sleep(delay * random.uniform(1.0, 1.5))
+
+
+def show_api_error(r, action: str):
+    if isinstance(r, requests.RequestException):
+        st.error(f"❌ {action} failed: {r}")
+        return
+    if r.status_code in (429, 503):
+        st.warning(
+            f"⏳ The voice service is busy (HTTP {r.status_code}), so {action.lower()} "
+            "didn't go through. Please try again in a few seconds."
+        )
+        return
+    st.error(f"❌ {action} failed (HTTP {r.status_code})")
+    try:
+        st.code(r.text[:2000])
+    except Exception:
+        pass
+
+
+def tts_stream_url(payload: dict) -> str:
+    """
+    Player URL for a reply: the browser streams it from GET /tts/stream and
+    starts playing at the first chunk. Posting the same payload (same
+    idempotency key) to /tts joins that request and returns its JSON once the
+    audio is in S3; if the POST gets there first, the player is redirected to
+    the stored file instead.
+    """
+    return f"{LAMBDA_TTS_STREAM}?{urlencode({'data': json.dumps(payload)})}"
+
+
+def request_tts_batch(texts: list):
+    """
+    Synthesize several messages for the current session in one round trip.
+    Returns (response, result) with result["audio_keys"] in the order of
+    `texts` (None where an item failed), or (response, None) on HTTP errors.
+    """
+    payload = {
+        "who": st.session_state.who,
+        "rs": st.session_state.rs,
+        "texts": texts,
+        "lang": st.session_state.lang,
+        "voice_id": st.session_state.voice_id,
+        "bucket": S3_BUCKET,
+        "key": st.session_state.audio_key,
+        "sample_sha256": st.session_state.sample_sha256,
+        "output_format": REPLY_FORMAT,
+        "bitrate": REPLY_BITRATE,
+    }
+    r = post_api(LAMBDA_TTS_BATCH, payload, timeout=300)
+    return r, (r.json() if r.ok else None)
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """{"llm_persona": 812.4, ...} from a `name;dur=ms, ...` Server-Timing header."""
+    timings = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if name and params.startswith("dur="):
+            timings[name] = float(params[4:])
+    return timings
+
+
+def show_timings(r, round_trip: float):
+    """Caption with the Lambda round trip and the server-side stage breakdown."""
+    if not SHOW_TIMINGS:
+        return
+    stages = parse_server_timing(r.headers.get("Server-Timing", ""))
+    parts = [f"round trip {round_trip * 1000:.0f} ms"]
+    parts += [f"{name} {ms:.0f} ms" for name, ms in stages.items()]
+    st.caption("⏱️ " + " · ".join(parts))
 
 
 def seconds_left() -> Optional[int]:
@@ -156,11 +527,109 @@ def end_session_local(reason: str):
     st.toast(f"Session ended: {reason}", icon="🛑")
     # reflect in DDB (if we have a lease)
     if st.session_state.get("session_id"):
-        mark_lease_status(st.session_state["session_id"], "ended")
+        save_lease_fields({"status": "ended"})
+
+
+# ================= Background work =================
+@st.cache_resource
+def background_pool() -> ThreadPoolExecutor:
+    """One pool per server process, shared by every browser session."""
+    return ThreadPoolExecutor(
+        max_workers=BACKGROUND_WORKERS, thread_name_prefix="after_words-bg"
+    )
+
+
+def run_in_background(label: str, fn, *args, success: Optional[str] = None, **kwargs):
+    """
+    Submit fn off the Streamlit thread. The outcome is reported by
+    report_background() on a later rerun; `success` is toasted if it worked.
+    Returns the future for callers that must wait on it.
+    """
+    future = background_pool().submit(fn, *args, **kwargs)
+    st.session_state.background_tasks.append((label, future, success))
+    return future
+
+
+def report_background():
+    """Surface finished background work (failures as warnings), keep the rest."""
+    pending = []
+    for label, future, success in st.session_state.background_tasks:
+        if not future.done():
+            pending.append((label, future, success))
+        elif future.exception() is not None:
+            st.warning(f"{label} failed: {future.exception()}")
+        elif success:
+            st.toast(success, icon="⏱️")
+    st.session_state.background_tasks = pending
+
+
+# ================= Speculative cloning =================
+def upload_sample(raw: bytes) -> Dict[str, Any]:
+    """Reduce and upload a voice sample; returns its S3 key, digest and sizes."""
+    sample, sample_sizes = prepare_sample(raw)
+    key = f"{uuid.uuid4()}.wav"
+    s3.upload_fileobj(io.BytesIO(sample), S3_BUCKET, key)
+    return {
+        "key": key,
+        "sample_sha256": hashlib.sha256(sample).hexdigest(),
+        "sample_sizes": sample_sizes,
+        "voice_id": None,
+    }
+
+
+def speculate(raw: bytes, who: str, session_id: str) -> Dict[str, Any]:
+    """
+    Runs on the background pool while the user fills in the form: upload the
+    sample, then clone it. The API leases the voice as "speculative" under
+    `session_id`, so the sweeper deletes it if the session never starts.
+    A failed clone leaves voice_id None (Start Chat then clones as before).
+    """
+    prepared = upload_sample(raw)
+    payload = {
+        "who": who or "After Words voice",
+        "bucket": S3_BUCKET,
+        "key": prepared["key"],
+        "sample_sha256": prepared["sample_sha256"],
+        "session_id": session_id,
+    }
+    try:
+        r = post_api(LAMBDA_CLONE, payload, timeout=120)
+        r.raise_for_status()
+        prepared["voice_id"] = r.json().get("voice_id")
+    except requests.RequestException as e:
+        prepared["clone_error"] = str(e)
+    return prepared
+
+
+def start_speculation(audio_file, who: str):
+    session_id = str(uuid.uuid4())
+    future = background_pool().submit(speculate, audio_file.getvalue(), who, session_id)
+    st.session_state.speculation = {
+        "file_id": audio_file.file_id,
+        "session_id": session_id,
+        "future": future,
+    }
+
+
+def prepared_sample(audio_file) -> Optional[Dict[str, Any]]:
+    """The speculative upload/clone of this file, waiting for it if still running."""
+    spec = st.session_state.speculation
+    if not spec or spec["file_id"] != audio_file.file_id:
+        return None
+    try:
+        return spec["future"].result(timeout=120)
+    except Exception as e:
+        st.toast(f"Voice preparation failed, retrying: {e}", icon="⚠️")
+        return None
 
 
 # ================= EventBridge Scheduler (one-off at T+ttl) =================
-def schedule_cleanup(session_id: str, voice_ids, ttl_seconds: int = DEFAULT_TTL):
+def schedule_cleanup(
+    session_id: str,
+    voice_ids,
+    ttl_seconds: int = DEFAULT_TTL,
+    sample_sha256: Optional[str] = None,
+):
     # buffer avoids "in the past" validation from slight clock skew
     buffer_sec = 90
     fire_dt = dt.datetime.utcnow() + dt.timedelta(seconds=ttl_seconds + buffer_sec)
@@ -172,6 +641,7 @@ def schedule_cleanup(session_id: str, voice_ids, ttl_seconds: int = DEFAULT_TTL)
             "session_id": session_id,
             "voice_ids": voice_ids,
             "due_epoch": int(fire_dt.timestamp()),
+            "sample_sha256": sample_sha256,
         }
     )
 
@@ -215,14 +685,23 @@ DEFAULTS = {
     "audio_file_id": None,
     "session_id": None,
     "expires_at": None,
+    "sample_sha256": None,
+    "audio_urls": {},
+    "background_tasks": [],
+    "speculation": None,
+    "lease_version": 0,
+    "lease_write": None,  # Start Chat's background put_lease_item
+    "restored_sid": None,  # sid whose turns are already in chat_log
 }
 for k, v in DEFAULTS.items():
     if k not in st.session_state:
         st.session_state[k] = v
 
+report_background()
+
 # ================= Restore from leases on refresh =================
 if SID and not st.session_state.get("session_started"):
-    # Try restoring from DDB lease
+    # Try restoring from DDB lease (cached: an ended session reruns this often)
     lease = get_lease(SID)
     if lease:
         st.session_state.session_id = SID
@@ -231,7 +710,12 @@ if SID and not st.session_state.get("session_started"):
         st.session_state.lang = lease.get("lang", "ar")
         st.session_state.voice_id = lease.get("el_voice_id")
         st.session_state.audio_key = lease.get("audio_key")
-        st.session_state.chat_log = lease.get("chat_log", [])
+        st.session_state.sample_sha256 = lease.get("sample_sha256")
+        st.session_state.lease_version = int(lease.get("version", 0))
+        if st.session_state.restored_sid != SID:
+            # Sessions written before per-turn storage still carry an inline chat_log
+            st.session_state.chat_log = load_turns(SID) or lease.get("chat_log", [])
+            st.session_state.restored_sid = SID
         st.session_state.expires_at = int(lease.get("expires_at_epoch", 0)) or None
         st.session_state.session_started = (
             lease.get("status", "") == "active"
@@ -248,6 +732,16 @@ with st.sidebar:
         st.session_state.start_chat_disabled = False
         st.session_state.audio_file_id = audio_file
 
+    # Upload + clone while the rest of the form is being filled in
+    spec = st.session_state.speculation
+    if (
+        SPECULATIVE_CLONE
+        and audio_file is not None
+        and not st.session_state.session_started
+        and (spec is None or spec["file_id"] != audio_file.file_id)
+    ):
+        start_speculation(audio_file, st.session_state.who)
+
     who = st.text_input("Who are you?", value=st.session_state.who)
     rs = st.text_input("Talking to (relation)", value=st.session_state.rs)
     lang = st.selectbox("Language", ["ar", "en", "fr"], index=0)
@@ -256,8 +750,22 @@ with st.sidebar:
     start_disabled = st.session_state.start_chat_disabled or (audio_file is None)
 
     if st.button("Start Chat", disabled=start_disabled):
-        # Init a brand-new session
-        session_id = str(uuid.uuid4())
+        with st.spinner("Starting chat..."):
+            # Usually already uploaded and cloned; otherwise do the upload now
+            prepared = prepared_sample(audio_file)
+            if prepared is not None and prepared["voice_id"]:
+                session_id = st.session_state.speculation["session_id"]
+            else:
+                # A clone that timed out here may still be leased as speculative
+                # under the old id; a fresh id keeps that lease (and its voice
+                # reference) separate so the sweeper can release it
+                session_id = str(uuid.uuid4())
+                prepared = prepared or upload_sample(audio_file.getvalue())
+        unique_key = prepared["key"]
+        sample_sha256 = prepared["sample_sha256"]
+        sample_sizes = prepared["sample_sizes"]
+
+        # Init a brand-new session (a speculative lease under this id becomes active)
         st.session_state.session_id = session_id
         set_sid_in_url(session_id)  # put sid in URL so refresh can restore
 
@@ -266,27 +774,34 @@ with st.sidebar:
         st.session_state.who = who
         st.session_state.rs = rs
         st.session_state.lang = lang
-
-        unique_key = f"{uuid.uuid4()}.wav"
-        s3.upload_fileobj(audio_file, S3_BUCKET, unique_key)
         st.session_state.audio_key = unique_key
+        st.session_state.sample_sha256 = sample_sha256
+        st.session_state.speculation = None
+        st.session_state.lease_version = 1  # written by put_lease_item below
+        st.session_state.restored_sid = session_id
 
+        # The first-message request goes out as soon as the sample is in S3;
+        # with a speculative voice it only pays for the LLM and synthesis
         payload = {
             "who": who,
             "rs": rs,
             "text": first_message,
             "lang": lang,
-            "voice_id": None,
+            "voice_id": prepared["voice_id"],
             "bucket": S3_BUCKET,
             "key": unique_key,
+            "sample_sha256": sample_sha256,
+            "output_format": REPLY_FORMAT,
+            "bitrate": REPLY_BITRATE,
+            "idempotency_key": f"{session_id}:0",
         }
 
         with st.spinner("Starting chat..."):
-            r = requests.post(
-                LAMBDA_TTS, data={"data": json.dumps(payload)}, timeout=60
-            )
+            sent = time.perf_counter()
+            r = post_api(LAMBDA_TTS, payload)
 
         if r.ok:
+            show_timings(r, time.perf_counter() - sent)
             result = r.json()
             st.session_state.voice_id = result.get("voice_id")
             audio_key = result.get("audio_key")
@@ -299,39 +814,181 @@ with st.sidebar:
             st.session_state.expires_at = exp
             st.session_state.session_started = True
 
-            # Write lease row (DDB) and schedule cleanup
-            put_lease_item(
+            # Lease row, first turn and cleanup schedule are written off the
+            # critical path; failures show up on the next rerun.
+            st.session_state.lease_write = run_in_background(
+                "Saving the session lease",
+                put_lease_item,
                 session_id=session_id,
                 voice_id=st.session_state.voice_id,
                 who=who,
                 rs=rs,
                 lang=lang,
                 audio_key=st.session_state.audio_key,
-                chat_log=st.session_state.chat_log,
                 started_at=now,
                 expires_at=exp,
                 status="active",
+                sample_sha256=sample_sha256,
+                sample_sizes=sample_sizes,
+            )
+            run_in_background(
+                "Saving the first turn",
+                put_turn,
+                session_id,
+                0,
+                st.session_state.chat_log[0],
+                exp,
             )
 
-            try:
-                schedule_cleanup(
+            if CLEANUP_MODE == "schedule":
+                run_in_background(
+                    "Scheduling cleanup",
+                    schedule_cleanup,
                     session_id=session_id,
                     voice_ids=(
-                        [st.session_state.voice_id] if st.session_state.voice_id else []
+                        [st.session_state.voice_id]
+                        if st.session_state.voice_id
+                        else []
                     ),
                     ttl_seconds=DEFAULT_TTL,
+                    sample_sha256=sample_sha256,
+                    success="Cleanup scheduled in 10 minutes.",
                 )
-                st.toast("Cleanup scheduled in 10 minutes.", icon="⏱️")
-            except Exception as e:
-                st.warning(f"Could not schedule cleanup: {e}")
         else:
-            st.error(f"❌ Failed to start chat (HTTP {r.status_code})")
-            try:
-                st.code(r.text[:2000])
-            except Exception:
-                pass
+            show_api_error(r, "Starting the chat")
 
 # ================= Main chat =================
+@st.fragment
+def chat_area():
+    """
+    Transcript and inputs. A new message or script reruns only this fragment,
+    so the sidebar and the countdown component are not rebuilt on every turn.
+    """
+    if st.session_state.session_started and seconds_left() == 0:
+        # Ran out since the last full run: end it and redraw the whole page
+        end_session_local("time limit reached")
+        st.rerun()
+
+    st.markdown(f"### Chat with: `{st.session_state.who}`")
+
+    for entry in st.session_state.chat_log:
+        with st.chat_message("user"):
+            st.markdown(entry["user"])
+        with st.chat_message("assistant"):
+            if entry["bot"].startswith("s3_key:"):
+                key = entry["bot"].split("s3_key:")[1]
+                st.audio(audio_source(key), format=audio_mime(key))
+            else:
+                st.markdown(entry["bot"])
+
+    # ---------- Scripted messages: one /tts/batch round trip ----------
+    with st.expander("📜 Send a script"):
+        script = st.text_area("One message per line", key="script")
+        if st.button("Send all", disabled=(seconds_left() == 0)):
+            texts = [line.strip() for line in script.splitlines() if line.strip()]
+            previous_voice_id = st.session_state.voice_id
+            entries, failed, r = [], 0, None
+            with st.spinner(f"Generating {len(texts)} replies..."):
+                # The API takes at most BATCH_MAX_ITEMS texts per request; later
+                # chunks reuse the voice the first one resolved
+                for start in range(0, len(texts), BATCH_MAX_ITEMS):
+                    chunk = texts[start : start + BATCH_MAX_ITEMS]
+                    r, result = request_tts_batch(chunk)
+                    if not result:
+                        break
+                    st.session_state.voice_id = result.get("voice_id")
+                    entries += [
+                        {"user": text, "bot": f"s3_key:{key}"}
+                        for text, key in zip(chunk, result["audio_keys"])
+                        if key
+                    ]
+                    failed += len(result.get("errors") or {})
+            if entries:
+                first_turn = len(st.session_state.chat_log)
+                st.session_state.chat_log.extend(entries)
+                if not put_turns(
+                    st.session_state.session_id,
+                    first_turn,
+                    entries,
+                    st.session_state.expires_at,
+                ):
+                    # Another tab added turns meanwhile: show the stored order
+                    st.session_state.chat_log = load_turns(st.session_state.session_id)
+                if st.session_state.voice_id != previous_voice_id:
+                    save_lease_fields({"el_voice_id": st.session_state.voice_id})
+                if failed:
+                    st.toast(f"{failed} message(s) failed", icon="⚠️")
+            if r is not None and not r.ok:
+                show_api_error(r, "Sending the script")
+            elif entries:
+                st.rerun(scope="fragment")
+
+    user_input = st.chat_input("Type your message...", disabled=(seconds_left() == 0))
+
+    if user_input and seconds_left() != 0:
+        with st.chat_message("user"):
+            st.markdown(user_input)
+
+        with st.chat_message("assistant"):
+            with st.spinner("Thinking..."):
+                payload = {
+                    "who": st.session_state.who,
+                    "rs": st.session_state.rs,
+                    "text": user_input,
+                    "lang": st.session_state.lang,
+                    "voice_id": st.session_state.voice_id,
+                    "bucket": S3_BUCKET,
+                    "key": st.session_state.audio_key,
+                    "output_format": REPLY_FORMAT,
+                    "bitrate": REPLY_BITRATE,
+                    # A resubmitted turn (double click, rerun, retry) is answered
+                    # once by the API instead of synthesised again
+                    "idempotency_key": (
+                        f"{st.session_state.session_id}:{len(st.session_state.chat_log)}"
+                    ),
+                }
+                sent = time.perf_counter()
+                if USE_TTS_STREAM:
+                    st.audio(
+                        tts_stream_url(payload),
+                        format=AUDIO_MIME["ogg" if REPLY_FORMAT == "opus" else "mp3"],
+                        autoplay=True,
+                    )
+                try:
+                    r = post_api(LAMBDA_TTS, payload)
+                except requests.RequestException as e:
+                    r = e
+
+                if isinstance(r, requests.Response) and r.ok:
+                    result = r.json()
+                    previous_voice_id = st.session_state.voice_id
+                    st.session_state.voice_id = result.get("voice_id")
+                    audio_key = result.get("audio_key")
+                    entry = {"user": user_input, "bot": f"s3_key:{audio_key}"}
+                    st.session_state.chat_log.append(entry)
+                    if not USE_TTS_STREAM:
+                        st.audio(audio_source(audio_key), format=audio_mime(audio_key))
+                    show_timings(r, time.perf_counter() - sent)
+
+                    # Persist the new turn; the lease only changes with the voice
+                    turn = len(st.session_state.chat_log) - 1
+                    written = put_turn(
+                        st.session_state.session_id,
+                        turn,
+                        entry,
+                        st.session_state.expires_at,
+                    )
+                    if written != turn:
+                        # Another tab added turns meanwhile: show the stored order
+                        st.session_state.chat_log = load_turns(
+                            st.session_state.session_id
+                        )
+                    if st.session_state.voice_id != previous_voice_id:
+                        save_lease_fields({"el_voice_id": st.session_state.voice_id})
+                else:
+                    show_api_error(r, "Chat")
+
+
 if st.session_state.session_started:
     left = seconds_left()
 
@@ -376,59 +1033,4 @@ if st.session_state.session_started:
     if left == 0:
         end_session_local("time limit reached")
 
-    st.markdown(f"### Chat with: `{st.session_state.who}`")
-
-    for entry in st.session_state.chat_log:
-        with st.chat_message("user"):
-            st.markdown(entry["user"])
-        with st.chat_message("assistant"):
-            if entry["bot"].startswith("s3_key:"):
-                key = entry["bot"].split("s3_key:")[1]
-                st.audio(fetch_audio_bytes(key), format="audio/wav")
-            else:
-                st.markdown(entry["bot"])
-
-    user_input = st.chat_input("Type your message...", disabled=(seconds_left() == 0))
-
-    if user_input and seconds_left() != 0:
-        with st.chat_message("user"):
-            st.markdown(user_input)
-
-        with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                payload = {
-                    "who": st.session_state.who,
-                    "rs": st.session_state.rs,
-                    "text": user_input,
-                    "lang": st.session_state.lang,
-                    "voice_id": st.session_state.voice_id,
-                    "bucket": S3_BUCKET,
-                    "key": st.session_state.audio_key,
-                }
-                r = requests.post(
-                    LAMBDA_TTS, data={"data": json.dumps(payload)}, timeout=60
-                )
-
-                if r.ok:
-                    result = r.json()
-                    st.session_state.voice_id = result.get("voice_id")
-                    audio_key = result.get("audio_key")
-                    st.session_state.chat_log.append(
-                        {"user": user_input, "bot": f"s3_key:{audio_key}"}
-                    )
-                    st.audio(fetch_audio_bytes(audio_key), format="audio/wav")
-
-                    # Persist incremental changes to the lease
-                    update_lease_fields(
-                        st.session_state.session_id,
-                        {
-                            "el_voice_id": st.session_state.voice_id,
-                            "chat_log": st.session_state.chat_log,
-                        },
-                    )
-                else:
-                    st.error(f"❌ Chat failed (HTTP {r.status_code})")
-                    try:
-                        st.code(r.text[:2000])
-                    except Exception:
-                        pass
+    chat_area()
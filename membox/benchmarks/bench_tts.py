@@ -0,0 +1,239 @@
+"""Offline load test for the membox ``/tts`` pipeline.
+
+Runs the FastAPI app in-process against the stand-ins in ``fakes.py`` and
+reports end-to-end and per-stage latency percentiles plus requests/sec at a
+set of concurrency levels. "stages" are measured at the stand-ins,
+"server_stages" are the app's own timings (the ``timings`` of each reply). Results are written as JSON so they can be diffed
+between releases.
+
+Usage:
+    python membox/benchmarks/bench_tts.py --concurrency 1 10 50 --turns 3 \
+        --output bench_results.json
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+from fakes import (
+    FakeChatModel,
+    FakeElevenLabs,
+    FakeS3,
+    Latencies,
+    StageRecorder,
+    fake_wav,
+)
+
+PACKAGE_DIR = Path(__file__).resolve().parents[1] / "membox"
+BUCKET = "bench-bucket"
+SAMPLE_KEY = "bench-sample.wav"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of ``values`` (pct in 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    lo = int(rank)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (rank - lo)
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    ms = [s * 1000.0 for s in seconds]
+    return {
+        "count": len(ms),
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "max_ms": round(max(ms), 2) if ms else 0.0,
+    }
+
+
+def load_app(
+    latencies: Latencies, recorder: StageRecorder, sentences: int, cache_backend: str
+):
+    """Import the membox app with every upstream SDK replaced by a stand-in."""
+    os.environ.setdefault("ELEVEN_API_KEY", "bench")
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ["CACHE_BACKEND"] = cache_backend
+    os.environ["VOICE_DEDUP"] = "0"  # the clone index needs DynamoDB
+    sys.path.insert(0, str(PACKAGE_DIR))
+
+    import utils
+
+    s3 = FakeS3(latencies, recorder)
+    s3.objects[(BUCKET, SAMPLE_KEY)] = fake_wav()
+    chat_model = FakeChatModel(
+        latencies=latencies, recorder=recorder, sentences=sentences
+    )
+    elevenlabs = FakeElevenLabs(latencies, recorder)
+    utils.get_s3_client = lambda: s3
+    utils.get_elevenlabs_client = lambda: elevenlabs
+    utils.get_chat_model = lambda: chat_model
+
+    spec = importlib.util.spec_from_file_location(
+        "membox_app", PACKAGE_DIR / "__main__.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+async def run_session(
+    client: httpx.AsyncClient, turns: int, lang: str, pipeline: bool
+) -> List[dict]:
+    """One chat session: the first turn clones, the rest reuse the voice."""
+    results = []
+    voice_id = None
+    for turn in range(turns):
+        payload = {
+            "who": "Bench",
+            "rs": "friend",
+            "text": f"Hello, how are you? ({turn})",
+            "lang": lang,
+            "voice_id": voice_id,
+            "bucket": BUCKET,
+            "key": SAMPLE_KEY,
+            "pipeline": pipeline,
+        }
+        start = time.perf_counter()
+        timings = {}
+        try:
+            r = await client.post("/tts", data={"data": json.dumps(payload)})
+            ok = r.status_code == 200
+            if ok:
+                body = r.json()
+                voice_id = body.get("voice_id") or voice_id
+                timings = body.get("timings", {})
+        except Exception:
+            ok = False
+        results.append(
+            {"ok": ok, "seconds": time.perf_counter() - start, "timings": timings}
+        )
+    return results
+
+
+async def run_level(
+    app, recorder: StageRecorder, concurrency: int, turns: int, lang: str, pipeline: bool
+):
+    recorder.reset()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None
+    ) as client:
+        start = time.perf_counter()
+        sessions = await asyncio.gather(
+            *(run_session(client, turns, lang, pipeline) for _ in range(concurrency))
+        )
+        wall = time.perf_counter() - start
+
+    requests = [r for session in sessions for r in session]
+    ok = [r["seconds"] for r in requests if r["ok"]]
+    server_stages: Dict[str, List[float]] = {}
+    for r in requests:
+        for stage, ms in r["timings"].items():
+            server_stages.setdefault(stage, []).append(ms / 1000.0)
+    return {
+        "concurrency": concurrency,
+        "sessions": concurrency,
+        "turns_per_session": turns,
+        "requests": len(requests),
+        "errors": len(requests) - len(ok),
+        "wall_s": round(wall, 3),
+        "rps": round(len(ok) / wall, 3) if wall else 0.0,
+        "latency": summarize(ok),
+        "stages": {k: summarize(v) for k, v in sorted(recorder.snapshot().items())},
+        "server_stages": {k: summarize(v) for k, v in sorted(server_stages.items())},
+    }
+
+
+def parse_args(argv=None):
+    defaults = Latencies()
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    p.add_argument("--turns", type=int, default=3, help="turns per session")
+    p.add_argument("--lang", default="fr")
+    p.add_argument("--sentences", type=int, default=3, help="sentences per LLM reply")
+    for stage in ("s3_download", "s3_upload", "llm", "voice_get", "clone", "generate"):
+        p.add_argument(
+            f"--{stage.replace('_', '-')}-latency",
+            dest=stage,
+            type=float,
+            default=getattr(defaults, stage),
+            help=f"injected {stage} latency in seconds",
+        )
+    p.add_argument("--jitter", type=float, default=defaults.jitter)
+    p.add_argument(
+        "--cache-backend",
+        choices=["off", "local"],
+        default="off",
+        help="reply/audio cache backend (off keeps runs comparable)",
+    )
+    p.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="overlap LLM generation and synthesis sentence by sentence",
+    )
+    p.add_argument("--output", default="bench_results.json")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    latencies = Latencies(
+        s3_download=args.s3_download,
+        s3_upload=args.s3_upload,
+        llm=args.llm,
+        voice_get=args.voice_get,
+        clone=args.clone,
+        generate=args.generate,
+        jitter=args.jitter,
+    )
+    recorder = StageRecorder()
+    app = load_app(latencies, recorder, args.sentences, args.cache_backend)
+
+    levels = []
+    for concurrency in args.concurrency:
+        level = asyncio.run(
+            run_level(app, recorder, concurrency, args.turns, args.lang, args.pipeline)
+        )
+        levels.append(level)
+        lat = level["latency"]
+        print(
+            f"c={concurrency:<3} req={level['requests']:<4} err={level['errors']:<3} "
+            f"rps={level['rps']:<8} p50={lat['p50_ms']}ms p95={lat['p95_ms']}ms "
+            f"p99={lat['p99_ms']}ms"
+        )
+
+    report = {
+        "run_id": str(uuid.uuid4()),
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "latencies_s": vars(latencies),
+        "config": {
+            "turns": args.turns,
+            "lang": args.lang,
+            "sentences": args.sentences,
+            "pipeline": args.pipeline,
+            "cache_backend": args.cache_backend,
+        },
+        "levels": levels,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
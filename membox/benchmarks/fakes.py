@@ -0,0 +1,221 @@
+"""Local stand-ins for S3, ElevenLabs and the OpenAI chat model.
+
+Every stand-in sleeps for a configurable latency (with optional jitter) instead
+of calling out to the network, and records how long each call took under a
+stage name so the benchmark can report per-stage percentiles.
+"""
+import io
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+@dataclass
+class Latencies:
+    """Injected latencies, in seconds."""
+
+    s3_download: float = 0.05
+    s3_upload: float = 0.08
+    llm: float = 0.6
+    voice_get: float = 0.1
+    clone: float = 2.0
+    generate: float = 1.2
+    jitter: float = 0.2
+
+    def sample(self, stage: str) -> float:
+        base = getattr(self, stage)
+        if not self.jitter:
+            return base
+        return max(0.0, base * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+class StageRecorder:
+    """Thread-safe collector of per-stage call durations (seconds)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, List[float]] = defaultdict(list)
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self._samples[stage].append(seconds)
+
+    def timed(self, stage: str, latencies: Latencies):
+        start = time.perf_counter()
+        time.sleep(latencies.sample(stage))
+        return start
+
+    def done(self, stage: str, start: float):
+        self.record(stage, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, List[float]]:
+        with self._lock:
+            return {k: list(v) for k, v in self._samples.items()}
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+
+class FakeS3:
+    """Subset of the boto3 S3 client used by the app, backed by a dict."""
+
+    def __init__(self, latencies: Latencies, recorder: StageRecorder):
+        self.latencies = latencies
+        self.recorder = recorder
+        self.objects: Dict[tuple, bytes] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, bucket: str, key: str) -> bytes:
+        with self._lock:
+            return self.objects.get((bucket, key), b"")
+
+    def _put(self, bucket: str, key: str, body: bytes):
+        with self._lock:
+            self.objects[(bucket, key)] = body
+
+    def download_fileobj(self, Bucket, Key, Fileobj, **_):
+        start = self.recorder.timed("s3_download", self.latencies)
+        Fileobj.write(self._get(Bucket, Key))
+        self.recorder.done("s3_download", start)
+
+    def get_object(self, Bucket, Key, **_):
+        start = self.recorder.timed("s3_download", self.latencies)
+        body = self._get(Bucket, Key)
+        self.recorder.done("s3_download", start)
+        return {"Body": io.BytesIO(body), "ContentLength": len(body)}
+
+    def upload_file(self, Filename, Bucket, Key, **_):
+        start = self.recorder.timed("s3_upload", self.latencies)
+        with open(Filename, "rb") as f:
+            self._put(Bucket, Key, f.read())
+        self.recorder.done("s3_upload", start)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, **_):
+        start = self.recorder.timed("s3_upload", self.latencies)
+        self._put(Bucket, Key, Fileobj.read())
+        self.recorder.done("s3_upload", start)
+
+    def put_object(self, Bucket, Key, Body=b"", **_):
+        start = self.recorder.timed("s3_upload", self.latencies)
+        self._put(Bucket, Key, Body if isinstance(Body, bytes) else Body.read())
+        self.recorder.done("s3_upload", start)
+        return {}
+
+    def generate_presigned_url(self, _op, Params=None, ExpiresIn=3600, **_):
+        return f"https://fake-s3.local/{Params['Bucket']}/{Params['Key']}?ttl={ExpiresIn}"
+
+
+class _FakeVoices:
+    def __init__(self, parent: "FakeElevenLabs"):
+        self._parent = parent
+
+    def get(self, voice_id: str, **_):
+        start = self._parent.recorder.timed("voice_get", self._parent.latencies)
+        voice = SimpleNamespace(voice_id=voice_id, settings=None)
+        self._parent.recorder.done("voice_get", start)
+        return voice
+
+    def delete(self, voice_id: str, **_):
+        return None
+
+
+class FakeElevenLabs:
+    """Stand-in for ``elevenlabs.client.ElevenLabs``.
+
+    Generated audio is ``bytes_per_char`` bytes per input character, yielded in
+    4 KiB chunks like the real SDK's iterator.
+    """
+
+    bytes_per_char = 400
+    chunk_size = 4096
+
+    def __init__(
+        self,
+        latencies: Latencies,
+        recorder: StageRecorder,
+        api_key: Optional[str] = None,
+        **_,
+    ):
+        self.latencies = latencies
+        self.recorder = recorder
+        self.voices = _FakeVoices(self)
+
+    def clone(self, name: str, description: str = "", files=(), **_):
+        start = self.recorder.timed("clone", self.latencies)
+        for path in files:
+            os.path.getsize(path)
+        voice = SimpleNamespace(voice_id=f"fake-{uuid.uuid4().hex[:12]}", name=name)
+        self.recorder.done("clone", start)
+        return voice
+
+    def generate(self, text: str, **_) -> Iterator[bytes]:
+        start = self.recorder.timed("generate", self.latencies)
+        payload = b"\xff\xfb" * (max(1, len(text)) * self.bytes_per_char // 2)
+        self.recorder.done("generate", start)
+        return (
+            payload[i : i + self.chunk_size]
+            for i in range(0, len(payload), self.chunk_size)
+        )
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that sleeps for the injected LLM latency and answers with a
+    fixed number of canned sentences.
+
+    When streamed, 30% of the latency is spent before the first token and the
+    rest is spread evenly over the remaining tokens.
+    """
+
+    latencies: Any
+    recorder: Any
+    sentences: int = 3
+
+    @property
+    def _llm_type(self) -> str:
+        return "membox-fake-chat"
+
+    def _reply(self) -> str:
+        return " ".join(
+            f"This is simulated sentence number {i + 1}." for i in range(self.sentences)
+        )
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **_):
+        start = self.recorder.timed("llm", self.latencies)
+        message = AIMessage(content=self._reply())
+        self.recorder.done("llm", start)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **_):
+        start = time.perf_counter()
+        total = self.latencies.sample("llm")
+        tokens = [f"{word} " for word in self._reply().split(" ")]
+        per_token = total * 0.7 / max(1, len(tokens))
+        time.sleep(total * 0.3)
+        for token in tokens:
+            time.sleep(per_token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        self.recorder.done("llm", start)
+
+
+def fake_wav(seconds: float = 5.0, rate: int = 16000) -> bytes:
+    """Silent mono 16-bit wav used as the uploaded reference sample."""
+    import wave
+
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\x00\x00" * int(seconds * rate))
+    return buf.getvalue()
@@ -1,17 +1,296 @@
+import time
 
+_INIT_STARTED = time.perf_counter()
+
+import asyncio
+import contextvars
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import profiler
+import ratelimit
+import timing
 import utils
 import uvicorn
-from fastapi import FastAPI, Form
+from fastapi import BackgroundTasks, FastAPI, Form, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from pydantic import BaseModel, Json
 from dotenv import load_dotenv
 from mangum import Mangum
+import json
 import logging
+import os
 load_dotenv()
 
+# Cold-start budget for module init (imports + client setup), in milliseconds.
+COLD_START_BUDGET_MS = float(os.getenv("COLD_START_BUDGET_MS", 1500))
+
+# Blocking SDK calls run on a bounded thread pool so the event loop stays free;
+# TTS_MAX_CONCURRENCY caps how many /tts requests are in the pipeline at once and
+# TTS_MAX_QUEUE how many may wait for a slot before new ones get a 503.
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", 32))
+TTS_MAX_CONCURRENCY = int(os.getenv("TTS_MAX_CONCURRENCY", 16))
+TTS_MAX_QUEUE = int(os.getenv("TTS_MAX_QUEUE", 64))
+# Overlap LLM generation with synthesis, sentence by sentence (per request: "pipeline").
+TTS_PIPELINE = os.getenv("TTS_PIPELINE", "0") == "1"
+# /tts/batch: texts per request, and how many of them are worked on at once.
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 20))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+_tts_slots: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+# In-flight requests by idempotency key, per event loop (single-flight).
+_flights: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+# Seconds between checks on a duplicate being computed in another container.
+IDEMPOTENCY_POLL = float(os.getenv("IDEMPOTENCY_POLL", 0.5))
+
 app = FastAPI()
 
 handler = Mangum(app)
 
+if os.getenv("PRELOAD_SDKS", "0") == "1":
+    utils.preload()
+
+INIT_MS = (time.perf_counter() - _INIT_STARTED) * 1000
+print(
+    json.dumps(
+        {
+            "metric": "cold_start",
+            "init_ms": round(INIT_MS, 1),
+            "budget_ms": COLD_START_BUDGET_MS,
+            "preloaded": os.getenv("PRELOAD_SDKS", "0") == "1",
+        }
+    )
+)
+if INIT_MS > COLD_START_BUDGET_MS:
+    logging.warning(
+        f"Cold start took {INIT_MS:.0f} ms, over the {COLD_START_BUDGET_MS:.0f} ms budget"
+    )
+
+
+def tts_slots() -> ratelimit.AdmissionQueue:
+    """Admission queue for the running event loop (Mangum may use several)."""
+    loop = asyncio.get_running_loop()
+    if loop not in _tts_slots:
+        _tts_slots[loop] = ratelimit.AdmissionQueue(TTS_MAX_CONCURRENCY, TTS_MAX_QUEUE)
+    return _tts_slots[loop]
+
+
+def in_flight() -> dict:
+    """Futures of the requests currently computing, by idempotency key."""
+    return _flights.setdefault(asyncio.get_running_loop(), {})
+
+
+def idempotency_key(request: Request, data: dict):
+    """Key from the Idempotency-Key header or ``data["idempotency_key"]``."""
+    key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    return utils.idempotency_cache_key(key, data.get("text")) if key else None
+
+
+def replayed(content: dict) -> JSONResponse:
+    return JSONResponse(content=content, headers={"Idempotent-Replayed": "true"})
+
+
+async def join_flight(key: str):
+    """Single-flight entry point for a request carrying ``key``.
+
+    A duplicate gets ``(response, None)``: the in-flight original's result once
+    it completes, or a recently completed one. Otherwise the caller gets
+    ``(None, flight)``, does the work and must settle ``flight``.
+    """
+    flights = in_flight()
+    if key in flights:
+        return replayed(await asyncio.shield(flights[key])), None
+    flight = asyncio.get_running_loop().create_future()
+    # mark failures as retrieved even when no duplicate is waiting
+    flight.add_done_callback(lambda f: f.cancelled() or f.exception())
+    flights[key] = flight
+    try:
+        content = await claim_flight(key)
+    except BaseException as e:
+        fail_flight(key, flight, e, claimed=False)
+        raise
+    if content is not None:
+        flights.pop(key, None)
+        flight.set_result(content)
+        return replayed(content), None
+    return None, flight
+
+
+async def claim_flight(key: str):
+    """Claim ``key`` across processes (containers, with the dynamodb backend).
+
+    Returns None once this request should compute the result, or the result
+    stored by the request that did. While another container holds the claim
+    its result is polled for; if that request fails, its claim is dropped and
+    this one takes over. After ``IDEMPOTENCY_WAIT`` it computes regardless.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + utils.IDEMPOTENCY_WAIT
+    while not await run_blocking(utils.claim_result, key):
+        content, pending = await run_blocking(utils.result_state, key)
+        if content is not None:
+            return content
+        if pending:
+            if loop.time() > deadline:
+                logging.warning(f"Gave up waiting for {key}; computing it here")
+                return None
+            await asyncio.sleep(IDEMPOTENCY_POLL)
+    return None
+
+
+async def complete_flight(key: str, flight: asyncio.Future, content: dict):
+    """Store the result for replay, then hand it to waiting duplicates."""
+    await run_blocking(utils.remember_result, key, content)
+    in_flight().pop(key, None)
+    flight.set_result(content)
+
+
+def fail_flight(
+    key: str, flight: asyncio.Future, error: BaseException, claimed: bool = True
+):
+    """Propagate a failure to waiting duplicates; nothing is stored and our
+    cross-process claim is dropped so a retry can run."""
+    if claimed:
+        executor.submit(utils.drop_claim, key)
+    in_flight().pop(key, None)
+    if isinstance(error, asyncio.CancelledError):
+        flight.cancel()
+    else:
+        flight.set_exception(error)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call on the shared executor without stalling the loop.
+
+    The caller's context (e.g. the request's stage timer) goes with it, and
+    the worker thread is sampled if the request is being profiled.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(
+        contextvars.copy_context().run, profiler.bind(fn), *args, **kwargs
+    )
+    return await loop.run_in_executor(executor, call)
+
+
+async def iterate_blocking(chunks):
+    """Async view over a blocking iterator; each ``next`` runs on the executor."""
+    chunks = iter(chunks)
+    while True:
+        chunk = await run_blocking(next, chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+async def pipelined_audio(data: dict, voice_task: asyncio.Future):
+    """Yield audio segments in order while the LLM is still generating.
+
+    Each finished sentence is sent to ElevenLabs as soon as it is complete, so
+    synthesis of earlier sentences overlaps generation of later ones.
+    """
+    sentences = utils.reply_sentences(data)
+    output_format = utils.audio_format(data)[0]
+    segments: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            async for sentence in iterate_blocking(sentences):
+                voice, _ = await voice_task
+                segment = run_blocking(
+                    utils.synthesize_bytes, voice, sentence, output_format
+                )
+                await segments.put(asyncio.ensure_future(segment))
+        finally:
+            await segments.put(None)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while (segment := await segments.get()) is not None:
+            yield await segment
+        await producer
+    finally:
+        # On failure stop generating and synthesising sentences nobody will read
+        discard(producer)
+        while not segments.empty():
+            if (segment := segments.get_nowait()) is not None:
+                discard(segment)
+
+
+def discard(future: asyncio.Future):
+    """Cancel ``future``; if it already failed, mark its error as retrieved."""
+    if not future.cancel() and not future.cancelled():
+        future.exception()
+
+
+async def abandon_voice(data: dict, voice_task: asyncio.Future):
+    """Wait out the voice lookup of a failed request and give its voice back."""
+    (result,) = await asyncio.gather(voice_task, return_exceptions=True)
+    if not isinstance(result, BaseException):
+        await run_blocking(utils.release_voice, data, result[1])
+
+
+async def tee_audio(source, listener: asyncio.Queue, received: list):
+    """Run ``source`` to completion, copying every chunk to ``listener``.
+
+    The copy in ``received`` is complete even if the listener stops reading.
+    """
+    try:
+        async for chunk in source:
+            received.append(chunk)
+            listener.put_nowait(chunk)
+    finally:
+        listener.put_nowait(None)
+
+
+def use_pipeline(data: dict) -> bool:
+    return bool(data.get("pipeline", TTS_PIPELINE))
+
+
+async def cached_reply(data: dict):
+    """The cached persona reply to ``data["text"]``, read off the event loop."""
+    key = utils.reply_cache_key(
+        data["text"], data["rs"], data["lang"], data.get("preprocess_mode")
+    )
+    return await run_blocking(utils.cache_get, key)
+
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """Profile a request when asked via X-Profile or picked by PROFILE_SAMPLE_RATE.
+
+    Covers the handler up to its response headers; a streamed body is not
+    included.
+    """
+    if not profiler.wanted(request.headers):
+        return await call_next(request)
+    profile = profiler.start(request.url.path)
+    try:
+        response = await call_next(request)
+    finally:
+        profile.stop()
+    location = await run_blocking(profiler.save, profile)
+    response.headers["X-Profile-Location"] = location
+    return response
+
+
+@app.exception_handler(ratelimit.QueueFull)
+async def queue_full(request: Request, exc: ratelimit.QueueFull):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Server busy: {exc}"},
+        headers={"Retry-After": "2"},
+    )
+
+
+@app.exception_handler(ratelimit.Throttled)
+async def throttled(request: Request, exc: ratelimit.Throttled):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "upstream": exc.upstream},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
 
 class Data(BaseModel):
     who: str
@@ -21,26 +300,283 @@ class Data(BaseModel):
 
 @app.get("/")
 async def enhance_audio() -> dict:
-    return {"audio": "enhanced"}
+    return {"audio": "enhanced", "init_ms": round(INIT_MS, 1)}
 
 
 @app.post("/tts")
-async def tts(data: Json = Form()):
-    load_dotenv()
+async def tts(request: Request, data: Json = Form()):
+    """Reply to ``data["text"]`` in the cloned voice and store it in S3.
+
+    With an idempotency key, concurrent duplicates share one computation and
+    completed results are replayed for ``IDEMPOTENCY_TTL`` seconds.
+    """
     logging.info("Received audio file...")
     logging.info(data)
-    wav_path = utils.download_wav_from_s3(data["bucket"], data["key"])
-    logging.info(f"input_wav path: {wav_path}")
-    logging.info(f"Translating from {data['text']}")
-    text = utils.preprocess_text(data["text"], data["rs"], data["lang"])
-    return utils.analyze_audio_elevenlabs(str(wav_path), data, text)
+    key = idempotency_key(request, data)
+    flight = None
+    if key:
+        replay, flight = await join_flight(key)
+        if replay is not None:
+            logging.info(f"Replaying result for {key}")
+            return replay
+    timer = timing.start()
+    try:
+        response = await synthesize_reply(data)
+    except BaseException as e:
+        if flight is not None:
+            fail_flight(key, flight, e)
+        raise
+    if flight is not None:
+        await complete_flight(key, flight, json.loads(response.body))
+    timer.emit("/tts", pipeline=use_pipeline(data))
+    return response
+
+
+async def synthesize_reply(data: dict):
+    async with tts_slots():
+        # A cached reply gains nothing from pipelining and may hit the audio cache
+        text = await cached_reply(data) if use_pipeline(data) else None
+        if use_pipeline(data) and text is None:
+            voice_task = asyncio.ensure_future(run_blocking(utils.resolve_voice, data))
+            try:
+                segments = [s async for s in pipelined_audio(data, voice_task)]
+                _, voice_id = await voice_task
+                _, extension, content_type = utils.audio_format(data)
+                key = utils.new_audio_key(extension)
+                await run_blocking(
+                    utils.upload_audio_to_s3,
+                    iter(segments),
+                    data["bucket"],
+                    key,
+                    content_type,
+                )
+            except BaseException:
+                await abandon_voice(data, voice_task)
+                raise
+            return utils.audio_response(key, voice_id)
+
+        if text is None:
+            logging.info(f"Translating from {data['text']}")
+            text = await run_blocking(
+                utils.preprocess_text,
+                data["text"],
+                data["rs"],
+                data["lang"],
+                mode=data.get("preprocess_mode"),
+            )
+        return await run_blocking(utils.analyze_audio_elevenlabs, data, text)
+
+
+@app.post("/tts/stream")
+async def tts_stream(
+    request: Request, background_tasks: BackgroundTasks, data: Json = Form()
+):
+    """Like ``/tts`` but streams audio chunks to the caller as ElevenLabs
+    produces them. The S3 key and voice id are sent up front as headers and the
+    full file is persisted to S3 in the background once the stream finishes.
+
+    A duplicate idempotency key gets the /tts JSON (audio_key, voice_id) once
+    the original's audio is in S3, instead of a second stream.
+    """
+    return await stream_reply(request, background_tasks, data)
+
+
+@app.get("/tts/stream")
+async def tts_stream_player(
+    request: Request, background_tasks: BackgroundTasks, data: Json = Query()
+):
+    """``/tts/stream`` as the ``src`` of an audio element, so the browser plays
+    the reply while it is generated. A duplicate is redirected to the stored
+    file; the caller gets the JSON by posting the same idempotency key to /tts.
+    """
+    return await stream_reply(request, background_tasks, data, redirect=True)
+
+
+async def stream_reply(
+    request: Request, background_tasks: BackgroundTasks, data: dict, redirect=False
+):
+    logging.info(data)
+    idem_key = idempotency_key(request, data)
+    flight = None
+    if idem_key:
+        replay, flight = await join_flight(idem_key)
+        if replay is not None:
+            logging.info(f"Replaying result for {idem_key}")
+            if not redirect:
+                return replay
+            url = await run_blocking(
+                utils.get_presigned_url,
+                data["bucket"],
+                json.loads(replay.body)["audio_key"],
+            )
+            return RedirectResponse(url)
+    timer = timing.start()
+    try:
+        output_format, extension, content_type = utils.audio_format(data)
+        slots = tts_slots()
+        await slots.acquire()
+    except BaseException as e:
+        # rejected before any work started (bad format, queue full)
+        if flight is not None:
+            fail_flight(idem_key, flight, e)
+        raise
+    try:
+        # Voice lookup / cloning runs concurrently with the LLM
+        voice_task = asyncio.ensure_future(run_blocking(utils.resolve_voice, data))
+        if use_pipeline(data):
+            source = pipelined_audio(data, voice_task)
+        else:
+            text = await run_blocking(
+                utils.preprocess_text,
+                data["text"],
+                data["rs"],
+                data["lang"],
+                mode=data.get("preprocess_mode"),
+            )
+            voice, _ = await voice_task
+            chunks = await run_blocking(
+                utils.synthesize, voice, text, True, output_format
+            )
+            source = iterate_blocking(chunks)
+        _, voice_id = await voice_task
+    except BaseException as e:
+        slots.release()
+        await abandon_voice(data, voice_task)
+        if flight is not None:
+            fail_flight(idem_key, flight, e)
+        raise
+
+    key = utils.new_audio_key(extension)
+    bucket = data["bucket"]
+    listener: asyncio.Queue = asyncio.Queue()
+    received = []
+    producer = asyncio.ensure_future(tee_audio(source, listener, received))
+    producer.add_done_callback(lambda _: slots.release())
+
+    async def body():
+        while (chunk := await listener.get()) is not None:
+            yield chunk
+        try:
+            await producer
+        except Exception:
+            # the aborted response never runs its background task
+            await persist()
+            raise
+
+    async def persist():
+        try:
+            await producer
+            size = await run_blocking(
+                utils.upload_audio_to_s3, iter(received), bucket, key, content_type
+            )
+        except Exception as e:
+            logging.exception(f"Audio generation failed; s3://{bucket}/{key} not saved")
+            # a voice cloned for this request is in no lease yet
+            await abandon_voice(data, voice_task)
+            if flight is not None:
+                fail_flight(idem_key, flight, e)
+            return
+        logging.info(f"Persisted {size} streamed bytes to s3://{bucket}/{key}")
+        if flight is not None:
+            content = {"statusCode": 200, "audio_key": key, "voice_id": voice_id}
+            await complete_flight(idem_key, flight, content)
+        timer.emit("/tts/stream", pipeline=use_pipeline(data), bytes=size)
+
+    background_tasks.add_task(persist)
+    return StreamingResponse(
+        body(),
+        media_type=content_type,
+        # Timings up to the first byte; the full breakdown is logged on persist
+        headers={
+            "X-Audio-Key": key,
+            "X-Voice-Id": voice_id,
+            "Server-Timing": timer.server_timing(),
+        },
+        background=background_tasks,
+    )
+
+
+@app.post("/clone")
+async def clone(data: Json = Form()):
+    """Clone (or reuse) the voice for a sample ahead of the first message.
+
+    With ``session_id`` the voice is leased as "speculative" under it, so it
+    is cleaned up if that session never starts.
+    """
+    logging.info(data)
+    timer = timing.start()
+    async with tts_slots():
+        _, voice_id = await run_blocking(utils.resolve_voice, data)
+        if data.get("session_id"):
+            try:
+                leased = await run_blocking(
+                    utils.put_speculative_lease,
+                    data["session_id"],
+                    voice_id,
+                    data.get("sample_sha256"),
+                )
+            except BaseException:
+                await run_blocking(utils.release_voice, data, voice_id)
+                raise
+            if not leased:
+                # the session already started with its own reference
+                await run_blocking(utils.release_voice, data, voice_id)
+    response = utils.timed_json({"statusCode": 200, "voice_id": voice_id})
+    timer.emit("/clone")
+    return response
+
+
+@app.post("/tts/batch")
+async def tts_batch(data: Json = Form()):
+    """Several texts for one session: ``data["texts"]`` instead of ``text``.
+
+    The voice is resolved once; each text then runs through the LLM and
+    synthesis, ``BATCH_CONCURRENCY`` at a time, and every item also takes a
+    regular /tts slot. Keys come back in input order, None for failed items.
+    """
+    logging.info(data)
+    texts = data.get("texts") or []
+    if not texts or len(texts) > BATCH_MAX_ITEMS:
+        raise HTTPException(400, f"texts must hold 1 to {BATCH_MAX_ITEMS} items")
+    timer = timing.start()
+    async with tts_slots():
+        voice, voice_id = await run_blocking(utils.resolve_voice, data)
+    item_slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def render(text: str) -> str:
+        async with item_slots, tts_slots():
+            reply = await run_blocking(
+                utils.preprocess_text,
+                text,
+                data["rs"],
+                data["lang"],
+                mode=data.get("preprocess_mode"),
+            )
+            cached = await run_blocking(utils.cached_audio_key, voice_id, reply, data)
+            if cached:
+                return cached
+            return await run_blocking(
+                utils.synthesize_to_s3, voice, voice_id, reply, data
+            )
+
+    results = await asyncio.gather(*(render(t) for t in texts), return_exceptions=True)
+    keys, errors = [], {}
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            logging.error(f"Batch item {i} failed: {result!r}")
+            keys.append(None)
+            errors[str(i)] = str(result)
+        else:
+            keys.append(result)
+    response = utils.batch_response(keys, voice_id, errors)
+    timer.emit("/tts/batch", items=len(texts), failed=len(errors))
+    return response
 
 
 def main():
     """_summary_"""
-    load_dotenv()
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
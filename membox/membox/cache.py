@@ -0,0 +1,127 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+
+def cache_key(namespace: str, *parts: Any) -> str:
+    """Content address for ``parts``: ``<namespace>:<sha256 of their JSON>``."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return f"{namespace}:{hashlib.sha256(blob.encode()).hexdigest()}"
+
+
+class NullCache:
+    """Backend used when caching is switched off."""
+
+    def get(self, key: str) -> Optional[str]:
+        return None
+
+    def set(self, key: str, value: str):
+        pass
+
+
+class LocalCache:
+    """In-process LRU cache with a per-entry TTL.
+
+    Survives across warm invocations of the same container only.
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._items[key] = (value, time.time() + self.ttl_seconds)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    # Claims: in one process concurrent work is coalesced by the caller, so a
+    # key can be claimed whenever it holds no value yet.
+    def claim(self, key: str, ttl_seconds: int) -> bool:
+        return self.get(key) is None
+
+    def lookup(self, key: str) -> Tuple[Optional[str], bool]:
+        return self.get(key), False
+
+    def release(self, key: str):
+        pass
+
+
+class DynamoCache:
+    """Cache shared by every container, stored in a DynamoDB table.
+
+    Items carry ``expires_at_epoch``; the table's TTL setting removes them
+    eventually and reads ignore entries that are already past it.
+    """
+
+    def __init__(self, table, ttl_seconds: int):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        item = self.table.get_item(Key={"cache_key": key}).get("Item")
+        if not item or int(item.get("expires_at_epoch", 0)) <= time.time():
+            return None
+        return item.get("value")
+
+    def set(self, key: str, value: str):
+        self.table.put_item(
+            Item={
+                "cache_key": key,
+                "value": value,
+                "expires_at_epoch": int(time.time()) + self.ttl_seconds,
+            }
+        )
+
+    def claim(self, key: str, ttl_seconds: int) -> bool:
+        """Mark ``key`` as being computed, unless it already holds a live
+        value or claim. True if the caller now owns it; ``set`` completes it."""
+        now = int(time.time())
+        try:
+            self.table.put_item(
+                Item={"cache_key": key, "pending": True, "expires_at_epoch": now + ttl_seconds},
+                ConditionExpression="attribute_not_exists(cache_key) OR expires_at_epoch <= :now",
+                ExpressionAttributeValues={":now": now},
+            )
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
+
+    def lookup(self, key: str) -> Tuple[Optional[str], bool]:
+        """``(value, pending)``: the stored value, or whether a claim is live."""
+        item = self.table.get_item(Key={"cache_key": key}, ConsistentRead=True).get("Item")
+        if not item or int(item.get("expires_at_epoch", 0)) <= time.time():
+            return None, False
+        return item.get("value"), bool(item.get("pending"))
+
+    def release(self, key: str):
+        """Drop an unfinished claim so others may compute ``key``."""
+        try:
+            self.table.delete_item(
+                Key={"cache_key": key}, ConditionExpression="attribute_exists(pending)"
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
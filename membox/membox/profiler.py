@@ -0,0 +1,160 @@
+"""Opt-in sampling profiler for live requests.
+
+A profiled request gets a background sampler that reads the stacks of the
+threads doing its blocking work (registered through ``bind``) every
+``PROFILE_INTERVAL_MS`` and counts them. The result is written in the
+collapsed-stack format (``frame;frame;frame count``) understood by
+flamegraph.pl, speedscope and inferno, to ``PROFILE_OUTPUT``: a local directory
+or ``s3://bucket/prefix``.
+"""
+import functools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+# Fraction of requests profiled without being asked (0 disables sampling).
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_HEADER = "x-profile"
+# X-Profile: <token> forces a profile; the header is ignored while this is unset.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 10))
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT", "/tmp/membox-profiles")
+# Profiles kept in a local PROFILE_OUTPUT directory; older ones are removed.
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 20))
+
+_current: ContextVar[Optional["Profile"]] = ContextVar("profile", default=None)
+
+
+def wanted(headers) -> bool:
+    """Profile this request? Forced by the header carrying PROFILE_TOKEN,
+    otherwise sampled."""
+    if PROFILE_TOKEN and headers.get(PROFILE_HEADER) == PROFILE_TOKEN:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        name = os.path.basename(code.co_filename)
+        stack.append(f"{code.co_name} ({name}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class Profile:
+    """Stack samples of the threads working for one request."""
+
+    def __init__(self, name: str, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.name = name
+        self.interval = interval_ms / 1000
+        self.samples: Counter = Counter()
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._run, name="profiler", daemon=True
+        )
+
+    def attach(self, thread_id: int):
+        with self._lock:
+            self._threads.add(thread_id)
+
+    def detach(self, thread_id: int):
+        with self._lock:
+            self._threads.discard(thread_id)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads)
+            for tid in threads:
+                frame = frames.get(tid)
+                if frame is not None:
+                    self.samples[_collapse(frame)] += 1
+
+    def start(self) -> "Profile":
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.samples.most_common())
+
+
+def start(name: str) -> Profile:
+    """Begin profiling the current request."""
+    profile = Profile(name).start()
+    _current.set(profile)
+    return profile
+
+
+def bind(fn):
+    """Wrap ``fn`` so the thread running it is sampled for the current
+    request's profile, if any (call it inside the request's context)."""
+    profile = _current.get()
+    if profile is None:
+        return fn
+
+    @functools.wraps(fn)
+    def traced(*args, **kwargs):
+        tid = threading.get_ident()
+        profile.attach(tid)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.detach(tid)
+
+    return traced
+
+
+def _rotate(directory: str, keep: int):
+    """Delete all but the newest ``keep`` profiles in ``directory``."""
+    paths = [
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(".collapsed")
+    ]
+    paths.sort(key=os.path.getmtime)
+    for path in paths[: max(0, len(paths) - keep)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # rotated by a concurrent save
+
+
+def save(profile: Profile) -> str:
+    """Write ``profile`` to ``PROFILE_OUTPUT``; returns where it went."""
+    route = profile.name.strip("/").replace("/", "_") or "root"
+    filename = f"{int(time.time())}-{route}-{uuid.uuid4().hex[:8]}.collapsed"
+    body = profile.collapsed()
+    if PROFILE_OUTPUT.startswith("s3://"):
+        import utils
+
+        bucket, _, prefix = PROFILE_OUTPUT[len("s3://") :].partition("/")
+        key = f"{prefix.rstrip('/')}/{filename}" if prefix else filename
+        utils.get_s3_client().put_object(
+            Bucket=bucket, Key=key, Body=body.encode(), ContentType="text/plain"
+        )
+        location = f"s3://{bucket}/{key}"
+    else:
+        os.makedirs(PROFILE_OUTPUT, exist_ok=True)
+        location = os.path.join(PROFILE_OUTPUT, filename)
+        with open(location, "w") as f:
+            f.write(body)
+        _rotate(PROFILE_OUTPUT, PROFILE_KEEP)
+    samples = sum(profile.samples.values())
+    logging.info(f"Profile of {profile.name}: {samples} samples -> {location}")
+    return location
@@ -0,0 +1,316 @@
+"""Client-side rate limiting and admission control.
+
+Every call to an upstream ("clone", "generate", "chat") first takes a token
+from that upstream's bucket, so bursts queue here instead of tripping the
+provider's quota; throttled calls (HTTP 429) are retried with full-jitter
+backoff.
+
+``AdmissionQueue`` bounds how many requests may wait for a /tts slot; beyond
+that callers are turned away with ``QueueFull`` (HTTP 503) right away.
+
+Buckets are per process by default, which shapes traffic when one server
+(uvicorn) takes every request. On Lambda each container serves one request at
+a time, so there ``RATE_LIMIT_BACKEND=dynamodb`` keeps each upstream's bucket
+in one DynamoDB item that every container draws from (``SharedTokenBucket``).
+The admission queue stays per process.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from decimal import Decimal
+from typing import Callable, Dict, Iterator, Optional
+
+from botocore.exceptions import ClientError
+
+import timing
+
+# Sustained calls per second and burst size per upstream; a rate of 0 disables it.
+RATE_LIMITS = {
+    "clone": float(os.getenv("RATE_LIMIT_CLONE", 5)),
+    "generate": float(os.getenv("RATE_LIMIT_GENERATE", 50)),
+    "chat": float(os.getenv("RATE_LIMIT_CHAT", 100)),
+}
+RATE_BURST = {
+    name: int(os.getenv(f"RATE_BURST_{name.upper()}", max(1, 2 * rate)))
+    for name, rate in RATE_LIMITS.items()
+}
+# "local": one bucket per process; "dynamodb": shared by every container.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")
+# Optimistic writes tried per token before falling back to the local bucket.
+SHARED_BUCKET_ATTEMPTS = 5
+SHARED_BUCKET_TTL = 3600  # an idle bucket's item expires (it would be full anyway)
+# Longest a call may wait for a token before it is rejected as throttled.
+RATE_MAX_WAIT = float(os.getenv("RATE_MAX_WAIT", 30))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 4))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.5))  # seconds
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 8.0))  # seconds
+
+
+class Throttled(Exception):
+    """An upstream stayed over quota (or its bucket stayed empty) too long."""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} is rate limited; retry in {retry_after:.1f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class QueueFull(Exception):
+    """Too many requests already waiting for a slot."""
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token; returns how long to wait before it may be used.
+
+        Tokens can go negative, so waiters are served in arrival order.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def cancel(self):
+        with self._lock:
+            self._tokens += 1
+
+
+class SharedTokenBucket:
+    """A TokenBucket kept in one DynamoDB item, shared by every container.
+
+    The item holds ``tokens`` as of ``updated_at`` (epoch seconds). Each
+    reservation refills, takes a token and writes the item back on condition
+    that nobody else wrote it since it was read. If the table can't be used,
+    the process's own bucket is used instead.
+    """
+
+    def __init__(self, table: Callable, name: str, rate: float, burst: int):
+        self._table = table
+        self.key = {"cache_key": f"ratelimit#{name}"}
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.fallback = TokenBucket(rate, burst)
+
+    def reserve(self) -> float:
+        try:
+            return self._reserve(self._table())
+        except Exception as e:
+            logging.warning(
+                f"Shared {self.key['cache_key']} unavailable ({e}); using the local bucket"
+            )
+            return self.fallback.reserve()
+
+    def _reserve(self, table) -> float:
+        for _ in range(SHARED_BUCKET_ATTEMPTS):
+            item = table.get_item(Key=self.key, ConsistentRead=True).get("Item")
+            now = time.time()
+            if item:
+                seen = item["updated_at"]
+                now = max(now, float(seen))  # containers' clocks may disagree
+                tokens = min(
+                    self.capacity, float(item["tokens"]) + (now - float(seen)) * self.rate
+                )
+                condition = {
+                    "ConditionExpression": "updated_at = :seen",
+                    "ExpressionAttributeValues": {":seen": seen},
+                }
+            else:
+                tokens = float(self.capacity)
+                condition = {"ConditionExpression": "attribute_not_exists(cache_key)"}
+            tokens -= 1
+            try:
+                table.put_item(
+                    Item={
+                        **self.key,
+                        "tokens": _decimal(tokens),
+                        "updated_at": _decimal(now),
+                        "expires_at_epoch": int(now) + SHARED_BUCKET_TTL,
+                    },
+                    **condition,
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                continue  # another container took a token first
+            return 0.0 if tokens >= 0 else -tokens / self.rate
+        raise RuntimeError(f"still contended after {SHARED_BUCKET_ATTEMPTS} attempts")
+
+    def cancel(self):
+        try:
+            self._table().update_item(
+                Key=self.key,
+                UpdateExpression="ADD tokens :one",
+                ExpressionAttributeValues={":one": 1},
+            )
+        except Exception as e:
+            logging.warning(f"Couldn't return a {self.key['cache_key']} token: {e}")
+
+
+def _decimal(x: float) -> Decimal:
+    return Decimal(str(round(x, 6)))
+
+
+_buckets: Dict[str, TokenBucket] = {
+    name: TokenBucket(rate, RATE_BURST[name])
+    for name, rate in RATE_LIMITS.items()
+    if rate > 0
+}
+
+
+def share(table: Callable):
+    """Draw every upstream's tokens from ``table()`` (RATE_LIMIT_BACKEND=dynamodb)."""
+    for name, bucket in list(_buckets.items()):
+        _buckets[name] = SharedTokenBucket(table, name, bucket.rate, bucket.capacity)
+
+
+def acquire(upstream: str):
+    """Block until ``upstream`` may be called; raises Throttled past RATE_MAX_WAIT."""
+    bucket = _buckets.get(upstream)
+    if bucket is None:
+        return
+    wait = bucket.reserve()
+    if wait > RATE_MAX_WAIT:
+        bucket.cancel()
+        raise Throttled(upstream, wait)
+    if wait:
+        time.sleep(wait)
+        timing.add("rate_wait", wait)
+
+
+def is_throttled(e: Exception) -> bool:
+    """HTTP 429 from ElevenLabs (ApiError) or OpenAI (RateLimitError)."""
+    if type(e).__name__ == "RateLimitError":
+        return True
+    return getattr(e, "status_code", None) == 429
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int, e: Exception) -> float:
+    cap = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return max(random.uniform(0, cap), _retry_after(e) or 0.0)
+
+
+def _throttled_again(upstream: str, attempt: int, e: Exception) -> float:
+    """Delay before the next attempt, or raise once retries are used up."""
+    delay = _backoff(attempt, e)
+    if attempt >= RETRY_MAX_ATTEMPTS:
+        raise Throttled(upstream, delay) from e
+    logging.warning(
+        f"{upstream} throttled (attempt {attempt}); retrying in {delay:.2f}s"
+    )
+    return delay
+
+
+def call(upstream: str, fn: Callable, *args, **kwargs):
+    """Call ``fn`` under ``upstream``'s rate limit, retrying when throttled."""
+    attempt = 0
+    while True:
+        attempt += 1
+        acquire(upstream)
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if not is_throttled(e):
+                raise
+            time.sleep(_throttled_again(upstream, attempt, e))
+
+
+def stream(upstream: str, start: Callable[[], Iterator]) -> Iterator:
+    """Like ``call`` for lazy iterators: the token is taken now, but the SDKs
+    only send the request on the first ``next``, so a throttled first chunk
+    starts the stream over."""
+    acquire(upstream)
+    return _retrying(upstream, start)
+
+
+def _retrying(upstream: str, start: Callable[[], Iterator]) -> Iterator:
+    attempt = 1
+    while True:
+        chunks = iter(start())
+        try:
+            first = next(chunks)
+        except StopIteration:
+            return
+        except Exception as e:
+            if not is_throttled(e):
+                raise
+            time.sleep(_throttled_again(upstream, attempt, e))
+            attempt += 1
+            acquire(upstream)
+            continue
+        yield first
+        yield from chunks
+        return
+
+
+class AdmissionQueue:
+    """At most ``limit`` requests in flight and ``max_queue`` waiting for a
+    slot (per event loop). Each admission logs a queue-depth metric line."""
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.waiting = 0
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(limit)
+
+    async def acquire(self):
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            self._metric("rejected", 0.0)
+            raise QueueFull(f"{self.waiting} requests already waiting")
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        waited = time.perf_counter() - start
+        timing.add("queue", waited)
+        self._metric("admitted", waited)
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    def _metric(self, outcome: str, waited: float):
+        print(
+            json.dumps(
+                {
+                    "metric": "tts_admission",
+                    "outcome": outcome,
+                    "queue_depth": self.waiting,
+                    "in_flight": self.in_flight,
+                    "wait_ms": round(waited * 1000, 1),
+                }
+            )
+        )
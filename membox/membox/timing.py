@@ -0,0 +1,112 @@
+"""Per-request stage timings.
+
+A ``StageTimer`` is started per request and found through a context variable,
+so the helpers in ``utils`` can time their stages without passing it around.
+``run_blocking`` copies the context into executor threads; stages that run
+concurrently (pipelined sentences) accumulate, so their sum can exceed the
+request total.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, Optional
+
+_current: ContextVar[Optional["StageTimer"]] = ContextVar("stage_timer", default=None)
+
+
+class StageTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def as_dict(self) -> Dict[str, float]:
+        """Stage durations in milliseconds, plus ``total`` since the start."""
+        with self._lock:
+            timings = {k: round(v * 1000, 1) for k, v in self.stages.items()}
+        timings["total"] = round((time.perf_counter() - self.started) * 1000, 1)
+        return timings
+
+    def server_timing(self) -> str:
+        """Value for the ``Server-Timing`` response header."""
+        return ", ".join(f"{k};dur={v}" for k, v in self.as_dict().items())
+
+    def emit(self, route: str, **fields):
+        """Print one structured metric line for log-based metrics."""
+        timings = self.as_dict()
+        total = timings.pop("total")
+        print(
+            json.dumps(
+                {
+                    "metric": "tts_stages",
+                    "route": route,
+                    "total_ms": total,
+                    "stages_ms": timings,
+                    **fields,
+                }
+            )
+        )
+
+
+def start() -> StageTimer:
+    """Begin timing the current request."""
+    timer = StageTimer()
+    _current.set(timer)
+    return timer
+
+
+def current() -> Optional[StageTimer]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block against the current request; a no-op outside one."""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def add(name: str, seconds: float):
+    """Record a duration measured by the caller against the current request."""
+    timer = _current.get()
+    if timer is not None:
+        timer.add(name, seconds)
+
+
+def timed_iter(name: str, chunks: Iterable) -> Iterator:
+    """Wrap a lazy iterator so the time spent producing items counts as ``name``."""
+    timer = _current.get()
+    if timer is None:
+        return iter(chunks)
+
+    def pull():
+        it = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                timer.add(name, time.perf_counter() - start)
+                return
+            timer.add(name, time.perf_counter() - start)
+            yield item
+
+    return pull()
@@ -1,139 +1,770 @@
 
+import hashlib
+import io
+import json
 import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from dotenv import load_dotenv
 import os
-from fastapi.responses import FileResponse
-from elevenlabs.client import ElevenLabs
-from elevenlabs import VoiceSettings, save
-from iso_language_codes import language_name
-from langchain.chat_models import init_chat_model
-from langchain.prompts import ChatPromptTemplate
-from langchain.chains.llm import LLMChain
+import re
+import shutil
+import time
+from typing import TYPE_CHECKING, Iterator, Optional
+from fastapi.responses import StreamingResponse
 from fastapi.responses import JSONResponse
+from botocore.config import Config
 import boto3
 import uuid
 import tempfile
+import cache
+import ratelimit
+import timing
+import voice_index
+
+if TYPE_CHECKING:  # heavy SDKs are imported lazily on the paths that use them
+    from langchain.chains.llm import LLMChain
+
+load_dotenv()
+
+# Size of the pooled HTTP connection pools shared by every request.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 50))
+
+TTS_MODEL = "eleven_multilingual_v2"
+
+# Content-addressed cache of LLM replies and synthesized audio keys.
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")  # local | dynamodb | off
+CACHE_TABLE = os.getenv("CACHE_TABLE", "tts_cache")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+
+# Completed /tts results are replayed to retries carrying the same idempotency key.
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 300))
+# Longest a duplicate waits for the request computing its result (the claim's
+# lifetime, so a crashed request's claim lapses); matches the Lambda timeout.
+IDEMPOTENCY_WAIT = int(os.getenv("IDEMPOTENCY_WAIT", 240))
+
+# Reuse the voice cloned from an identical sample (indexed in the leases table).
+VOICE_DEDUP = os.getenv("VOICE_DEDUP", "1") == "1"
+LEASES_TABLE = os.getenv("LEASES_TABLE", "leases")
+# Lifetime of a voice cloned ahead of Start Chat that no session has claimed.
+SPECULATIVE_TTL = int(os.getenv("SPECULATIVE_TTL", 900))
+
+# "stream": pipe the ElevenLabs audio iterator straight into S3 (no disk I/O).
+# "file": spool to a per-request temp file first, then upload it.
+AUDIO_UPLOAD_MODE = os.getenv("AUDIO_UPLOAD_MODE", "stream")
+
+# Local LRU cache of reference samples, keyed by (bucket, key).
+SAMPLE_CACHE_DIR = os.getenv("SAMPLE_CACHE_DIR", "/tmp/membox-samples")
+SAMPLE_CACHE_MAX_BYTES = int(os.getenv("SAMPLE_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+_sample_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_sample_cache_bytes = 0
+_sample_cache_lock = threading.Lock()
+
+# Reply audio encoding: codec -> (ElevenLabs output_format prefix, extension, content type).
+# Overridable per request with the "output_format" / "bitrate" payload keys.
+AUDIO_CODECS = {
+    "mp3": ("mp3_44100", "mp3", "audio/mpeg"),
+    "opus": ("opus_48000", "ogg", "audio/ogg"),
+}
+AUDIO_BITRATES = (32, 64, 96, 128, 192)  # kbps supported by ElevenLabs
+AUDIO_FORMAT = os.getenv("AUDIO_FORMAT", "mp3")
+AUDIO_BITRATE = int(os.getenv("AUDIO_BITRATE", 64))
+
+
+@lru_cache(maxsize=None)
+def get_s3_client():
+    """Process-wide S3 client with a pooled, keep-alive connection pool."""
+    return boto3.client(
+        "s3",
+        config=Config(
+            max_pool_connections=HTTP_POOL_SIZE,
+            tcp_keepalive=True,
+            retries={"mode": "standard"},
+        ),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_elevenlabs_client():
+    """Process-wide ElevenLabs client reusing one pooled httpx session."""
+    import httpx
+    from elevenlabs.client import ElevenLabs
+
+    return ElevenLabs(
+        api_key=os.environ["ELEVEN_API_KEY"],
+        httpx_client=httpx.Client(
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_SIZE,
+                max_keepalive_connections=HTTP_POOL_SIZE,
+            ),
+            timeout=httpx.Timeout(120.0, connect=10.0),
+        ),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_dynamodb():
+    """Process-wide DynamoDB resource sharing one connection pool."""
+    return boto3.resource(
+        "dynamodb",
+        config=Config(max_pool_connections=HTTP_POOL_SIZE, retries={"mode": "standard"}),
+    )
+
+
+def get_leases_table():
+    return get_dynamodb().Table(LEASES_TABLE)
+
+
+@lru_cache(maxsize=None)
+def get_cache():
+    if CACHE_BACKEND == "dynamodb":
+        return cache.DynamoCache(get_dynamodb().Table(CACHE_TABLE), CACHE_TTL_SECONDS)
+    if CACHE_BACKEND == "off":
+        return cache.NullCache()
+    return cache.LocalCache(CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES)
+
+
+@lru_cache(maxsize=None)
+def get_idempotency_cache():
+    """Replay store for completed requests; shared across containers with the
+    dynamodb backend, per process otherwise (even when caching is off)."""
+    if CACHE_BACKEND == "dynamodb":
+        return cache.DynamoCache(get_dynamodb().Table(CACHE_TABLE), IDEMPOTENCY_TTL)
+    return cache.LocalCache(IDEMPOTENCY_TTL, CACHE_MAX_ENTRIES)
+
+
+if ratelimit.RATE_LIMIT_BACKEND == "dynamodb":
+    # bucket items live next to the cache entries; the table is opened on first use
+    ratelimit.share(lambda: get_dynamodb().Table(CACHE_TABLE))
+
+
+def idempotency_cache_key(key: str, text: str) -> str:
+    # the text is part of the key so a reused key can't replay a different reply
+    return cache.cache_key("idempotency", key, text)
+
+
+def claim_result(key: str) -> bool:
+    """Claim the computation of ``key`` (across containers with the dynamodb
+    backend); False while another request holds it or its result is stored."""
+    try:
+        return get_idempotency_cache().claim(key, IDEMPOTENCY_WAIT)
+    except Exception as e:  # compute rather than fail on a cache outage
+        logging.warning(f"Idempotency claim failed for {key}: {e}")
+        return True
+
+
+def result_state(key: str) -> tuple:
+    """``(result, pending)`` for an idempotency cache key."""
+    try:
+        value, pending = get_idempotency_cache().lookup(key)
+    except Exception as e:
+        logging.warning(f"Idempotency read failed for {key}: {e}")
+        return None, False
+    return (json.loads(value) if value else None), pending
+
+
+def drop_claim(key: str):
+    try:
+        get_idempotency_cache().release(key)
+    except Exception as e:
+        logging.warning(f"Idempotency release failed for {key}: {e}")
+
+
+def remember_result(key: str, content: dict):
+    try:
+        get_idempotency_cache().set(key, json.dumps(content))
+    except Exception as e:
+        logging.warning(f"Idempotency write failed for {key}: {e}")
+
+
+def cache_get(key: str) -> Optional[str]:
+    try:
+        value = get_cache().get(key)
+    except Exception as e:  # a cache outage must not fail the request
+        logging.warning(f"Cache read failed for {key}: {e}")
+        return None
+    logging.info(f"Cache {'hit' if value is not None else 'miss'}: {key}")
+    return value
+
+
+def cache_set(key: str, value: str):
+    try:
+        get_cache().set(key, value)
+    except Exception as e:
+        logging.warning(f"Cache write failed for {key}: {e}")
+
+
+def reply_cache_key(text: str, role: str, lang: str, mode: Optional[str] = None) -> str:
+    return cache.cache_key("reply", role, text, lang, mode or PREPROCESS_MODE)
+
+
+def audio_cache_key(
+    voice_id: str, text: str, bucket: str, output_format: Optional[str] = None
+) -> str:
+    settings = get_voice_settings()
+    output_format = output_format or audio_format()[0]
+    return cache.cache_key(
+        "audio", voice_id, text, TTS_MODEL, settings.dict(), bucket, output_format
+    )
+
+
+def audio_format(data: Optional[dict] = None) -> tuple:
+    """``(output_format, extension, content type)`` requested by ``data``.
+
+    Unknown codecs fall back to ``AUDIO_FORMAT``; bitrates snap to the nearest
+    one ElevenLabs supports.
+    """
+    data = data or {}
+    codec = data.get("output_format") or AUDIO_FORMAT
+    if codec not in AUDIO_CODECS:
+        logging.warning(f"Unsupported output_format {codec!r}; using {AUDIO_FORMAT}")
+        codec = AUDIO_FORMAT
+    bitrate = int(data.get("bitrate") or AUDIO_BITRATE)
+    bitrate = min(AUDIO_BITRATES, key=lambda b: abs(b - bitrate))
+    prefix, extension, content_type = AUDIO_CODECS[codec]
+    return f"{prefix}_{bitrate}", extension, content_type
+
+
+@lru_cache(maxsize=None)
+def get_voice_settings():
+    from elevenlabs import VoiceSettings
+
+    return VoiceSettings(stability=0.5, similarity_boost=1.0, style=0.7)
+
+
+def preload():
+    """Import the heavy SDKs and build the shared clients ahead of the first request."""
+    get_s3_client()
+    get_elevenlabs_client()
+    get_chat_model()
+    get_voice_settings()
+    import iso_language_codes  # noqa: F401
+    import langchain.chains.llm  # noqa: F401
+
+
+class AudioStream(io.RawIOBase):
+    """Read-only file object over an iterator of audio chunks.
+
+    Lets ``upload_fileobj`` consume the ElevenLabs generator directly; boto3
+    switches to a multipart upload on its own once the stream gets large.
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = iter(chunks)
+        self._pending = b""
+        self.bytes_read = 0
+        self.pull_seconds = 0.0  # time spent waiting on ``chunks``
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buf) -> int:
+        while not self._pending:
+            start = time.perf_counter()
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+            finally:
+                self.pull_seconds += time.perf_counter() - start
+        n = min(len(buf), len(self._pending))
+        buf[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        self.bytes_read += n
+        return n
+
+
+def upload_audio_to_s3(
+    audio: Iterator[bytes], bucket: str, key: str, content_type: str = "audio/mpeg"
+) -> int:
+    """Upload generated audio to ``bucket/key`` and return its size in bytes."""
+    s3 = get_s3_client()
+    extra_args = {"ContentType": content_type}
+    # ``audio`` may still be generating while it is read; that time is
+    # "generate" (see ``synthesize``) and is left out of save/s3_upload.
+    stream = AudioStream(audio)
+    if AUDIO_UPLOAD_MODE == "file":
+        with tempfile.NamedTemporaryFile(suffix=os.path.splitext(key)[1]) as tmp:
+            start = time.perf_counter()
+            shutil.copyfileobj(stream, tmp)
+            tmp.flush()
+            timing.add("save", time.perf_counter() - start - stream.pull_seconds)
+            with timing.stage("s3_upload"):
+                s3.upload_file(tmp.name, bucket, key, ExtraArgs=extra_args)
+            return stream.bytes_read
+    start = time.perf_counter()
+    s3.upload_fileobj(io.BufferedReader(stream), bucket, key, ExtraArgs=extra_args)
+    timing.add("s3_upload", time.perf_counter() - start - stream.pull_seconds)
+    return stream.bytes_read
+
+
+def _evict_samples(keep: tuple):
+    """Drop least-recently-used samples until the cache fits its byte budget."""
+    global _sample_cache_bytes
+    while _sample_cache_bytes > SAMPLE_CACHE_MAX_BYTES and len(_sample_cache) > 1:
+        cache_key, (path, size) = next(iter(_sample_cache.items()))
+        if cache_key == keep:
+            _sample_cache.move_to_end(cache_key)
+            continue
+        del _sample_cache[cache_key]
+        _sample_cache_bytes -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        logging.info(f"Evicted cached sample s3://{cache_key[0]}/{cache_key[1]}")
 
 
 def download_wav_from_s3(bucket_name: str, object_key: str) -> str:
-    s3 = boto3.client("s3")
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-    s3.download_fileobj(bucket_name, object_key, temp_file)
-    temp_file.close()
-    return temp_file.name
+    """Return a local path for ``bucket_name/object_key``, downloading on a miss.
 
+    Samples are kept in a size-bounded LRU cache under ``SAMPLE_CACHE_DIR`` so
+    warm containers reuse them without filling ``/tmp``.
+    """
+    global _sample_cache_bytes
+    cache_key = (bucket_name, object_key)
+    with _sample_cache_lock:
+        hit = _sample_cache.get(cache_key)
+        if hit and os.path.exists(hit[0]):
+            _sample_cache.move_to_end(cache_key)
+            return hit[0]
 
-def preprocess_text(text: str, role: str, lang: str) -> str:
-    load_dotenv(".env")
-    gpt_3_5 = init_chat_model("gpt-3.5-turbo", model_provider="openai", temperature=0.7)
-    role_prompt = ChatPromptTemplate.from_template(
-        """
+    os.makedirs(SAMPLE_CACHE_DIR, exist_ok=True)
+    name = hashlib.sha256(f"{bucket_name}/{object_key}".encode()).hexdigest()
+    path = os.path.join(SAMPLE_CACHE_DIR, f"{name}.wav")
+    s3 = get_s3_client()
+    with tempfile.NamedTemporaryFile(dir=SAMPLE_CACHE_DIR, delete=False) as tmp:
+        try:
+            with timing.stage("s3_download"):
+                s3.download_fileobj(bucket_name, object_key, tmp)
+        except BaseException:
+            # not in the cache yet, so eviction would never remove it
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    os.replace(tmp.name, path)
+    size = os.path.getsize(path)
+
+    with _sample_cache_lock:
+        previous = _sample_cache.pop(cache_key, None)
+        if previous:
+            _sample_cache_bytes -= previous[1]
+        _sample_cache[cache_key] = (path, size)
+        _sample_cache_bytes += size
+        _evict_samples(keep=cache_key)
+    return path
+
+
+ROLE_TEMPLATE = """
         You are acting as: {role}
         Respond to this message **as if you were this person**:
         "{question}"
         Only write the answer this person would give.
         """
-    )
-    role_chain = LLMChain(llm=gpt_3_5, prompt=role_prompt)
-    translate_prompt = ChatPromptTemplate.from_template(
-        """
+
+TRANSLATE_TEMPLATE = """
     Translate the following text into {language}. Only return the translation, nothing else.
 
     Text:
     \"\"\"{text}\"\"\"
     """
+
+ROLE_IN_LANGUAGE_TEMPLATE = """
+        You are acting as: {role}
+        Respond to this message **as if you were this person**:
+        "{question}"
+        Only write the answer this person would give, written entirely in {language}.
+        """
+
+# "single": one LLM call answers in persona directly in the target language.
+# "chain": answer in persona, then translate (two sequential calls).
+PREPROCESS_MODE = os.getenv("PREPROCESS_MODE", "single")
+
+
+@lru_cache(maxsize=None)
+def get_chat_model():
+    """Chat model shared by every chain; built once per process."""
+    from langchain.chat_models import init_chat_model
+
+    return init_chat_model("gpt-3.5-turbo", model_provider="openai", temperature=0.7)
+
+
+@lru_cache(maxsize=None)
+def get_chain(template: str) -> "LLMChain":
+    """LLMChain for ``template``; built once per process and reused."""
+    from langchain.chains.llm import LLMChain
+    from langchain.prompts import ChatPromptTemplate
+
+    return LLMChain(
+        llm=get_chat_model(), prompt=ChatPromptTemplate.from_template(template)
     )
-    translate_chain = LLMChain(llm=gpt_3_5, prompt=translate_prompt)
-    answer_as_role = role_chain.run({"role": role, "question": text})
-    translated_answer = translate_chain.run(
-        {"text": answer_as_role, "language": language_name(lang)}
-    )
+
+
+def preprocess_text(
+    text: str, role: str, lang: str, mode: Optional[str] = None
+) -> str:
+    from iso_language_codes import language_name
+
+    mode = mode or PREPROCESS_MODE
+    key = reply_cache_key(text, role, lang, mode)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached
+
+    if mode == "single":
+        with timing.stage("llm_persona"):
+            answer = ratelimit.call(
+                "chat",
+                get_chain(ROLE_IN_LANGUAGE_TEMPLATE).run,
+                {"role": role, "question": text, "language": language_name(lang)},
+            )
+        logging.debug(f"Response as role in {lang}: {answer}")
+        cache_set(key, answer)
+        return answer
+
+    with timing.stage("llm_persona"):
+        answer_as_role = ratelimit.call(
+            "chat", get_chain(ROLE_TEMPLATE).run, {"role": role, "question": text}
+        )
+    with timing.stage("llm_translate"):
+        translated_answer = ratelimit.call(
+            "chat",
+            get_chain(TRANSLATE_TEMPLATE).run,
+            {"text": answer_as_role, "language": language_name(lang)},
+        )
     print("🧔 Response as Role:\n", answer_as_role)
     print("\n🌍 Translated:\n", translated_answer)
+    cache_set(key, translated_answer)
     return translated_answer
 
 
-def check_voice_id(input_wav: str) -> str:
-    client = ElevenLabs(
-        api_key=os.environ["ELEVEN_API_KEY"],
+# Sentence boundary: terminal punctuation (incl. Arabic "؟") followed by whitespace.
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?؟…])\s+")
+# Shorter fragments are merged into the next sentence to avoid choppy audio.
+MIN_SENTENCE_CHARS = int(os.getenv("MIN_SENTENCE_CHARS", 40))
+
+
+def stream_reply(
+    text: str, role: str, lang: str, mode: Optional[str] = None
+) -> Iterator[str]:
+    """Like ``preprocess_text`` but yields the final answer token by token.
+
+    In "chain" mode the persona answer is produced first and only the
+    translation is streamed.
+    """
+    from iso_language_codes import language_name
+
+    mode = mode or PREPROCESS_MODE
+    key = reply_cache_key(text, role, lang, mode)
+    cached = cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    if mode == "single":
+        streamed_stage = "llm_persona"
+        prompt = get_chain(ROLE_IN_LANGUAGE_TEMPLATE).prompt.format_messages(
+            role=role, question=text, language=language_name(lang)
+        )
+    else:
+        streamed_stage = "llm_translate"
+        with timing.stage("llm_persona"):
+            answer_as_role = ratelimit.call(
+                "chat", get_chain(ROLE_TEMPLATE).run, {"role": role, "question": text}
+            )
+        prompt = get_chain(TRANSLATE_TEMPLATE).prompt.format_messages(
+            text=answer_as_role, language=language_name(lang)
+        )
+    answer = []
+    tokens = ratelimit.stream("chat", lambda: get_chat_model().stream(prompt))
+    for chunk in timing.timed_iter(streamed_stage, tokens):
+        if chunk.content:
+            answer.append(chunk.content)
+            yield chunk.content
+    cache_set(key, "".join(answer))
+
+
+def split_sentences(tokens: Iterator[str]) -> Iterator[str]:
+    """Regroup a token stream into sentences as soon as each one is complete."""
+    buffer = ""
+    for token in tokens:
+        buffer += token
+        parts = SENTENCE_BOUNDARY.split(buffer)
+        ready, buffer = parts[:-1], parts[-1]
+        pending = ""
+        for part in ready:
+            pending = f"{pending} {part}".strip()
+            if len(pending) >= MIN_SENTENCE_CHARS:
+                yield pending
+                pending = ""
+        if pending:
+            buffer = f"{pending} {buffer}"
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def reply_sentences(data: dict) -> Iterator[str]:
+    """Sentences of the persona reply to ``data["text"]``, in order."""
+    return split_sentences(
+        stream_reply(
+            data["text"], data["rs"], data["lang"], mode=data.get("preprocess_mode")
+        )
     )
+
+
+def check_voice_id(input_wav: str) -> str:
+    client = get_elevenlabs_client()
     client.voices.get_all()
 
 
 def analyze_audio_elevenlabs_voice_id(
     voice_id: str, data: dict, text: str
-) -> FileResponse:
+) -> StreamingResponse:
     """Process and convert audio data using ELEVEN LABS.
 
     Args:
         data (bytes): The audio data as bytes.
         text (str): The text to be synthesized.
     """
-    client = ElevenLabs(
-        api_key=os.environ["ELEVEN_API_KEY"],
-    )
-    voice = client.voices.get(voice_id)
-    audio = client.generate(
-        text=text,
-        voice=voice,
-        model="eleven_multilingual_v2",
-        voice_settings=VoiceSettings(stability=0.5, similarity_boost=1.0, style=0.7),
-    )
-    output_wav = "/tmp/output.wav"
-    logging.info(output_wav)
-    save(audio, output_wav)
-    logging.info("Finished!")
+    output_format, _, content_type = audio_format(data)
+    voice = get_elevenlabs_client().voices.get(voice_id)
+    audio = synthesize(voice, text, stream=True, output_format=output_format)
     logging.info("Sending data...")
-    return FileResponse(output_wav)
+    return StreamingResponse(audio, media_type=content_type)
 
 
-def analyze_audio_elevenlabs(input_wav: str, data: dict, text: str) -> FileResponse:
-    """Process and convert audio data using ELEVEN LABS.
+def resolve_voice(data: dict):
+    """Return ``(voice, voice_id)`` for the request, cloning when needed.
 
-    Args:
-        data (bytes): The audio data as bytes.
-        text (str): The text to be synthesized.
+    The reference sample is only fetched from S3 when a new voice has to be
+    cloned; follow-up turns reuse ``data["voice_id"]`` unless it no longer
+    exists. With ``VOICE_DEDUP`` a sample whose digest is already indexed
+    reuses the live voice instead.
     """
-    client = ElevenLabs(
-        api_key=os.environ["ELEVEN_API_KEY"],
-    )
-    voice = None
+    from elevenlabs.core import ApiError
+
+    client = get_elevenlabs_client()
     voice_id = data.get("voice_id")
-    if not voice_id:
-        voice = client.clone(
+    if voice_id:
+        try:
+            with timing.stage("voice_lookup"):
+                return client.voices.get(voice_id), voice_id
+        except ApiError as e:
+            if e.status_code not in (400, 404):
+                raise
+        # e.g. a speculative clone the sweeper removed after SPECULATIVE_TTL
+        logging.info(f"Voice {voice_id} is gone; cloning the sample again")
+        data["voice_id"] = None  # the new voice's reference is this request's
+
+    input_wav = None
+    digest = data.get("sample_sha256")
+    if VOICE_DEDUP:
+        if not digest:
+            input_wav = download_wav_from_s3(data["bucket"], data["key"])
+            digest = voice_index.file_sha256(input_wav)
+        with timing.stage("voice_lookup"):
+            voice = reuse_indexed_voice(digest)
+        if voice is not None:
+            return voice, voice.voice_id
+
+    input_wav = input_wav or download_wav_from_s3(data["bucket"], data["key"])
+    logging.info(f"input_wav path: {input_wav}")
+    with timing.stage("clone"):
+        voice = ratelimit.call(
+            "clone",
+            client.clone,
             name=data["who"],
             description="N/A",  # Optional
             files=[input_wav],
         )
-        voice_id = voice.voice_id
-    else:
-        voice = client.voices.get(voice_id)
+    if VOICE_DEDUP and not voice_index.register(
+        get_leases_table(), digest, voice.voice_id
+    ):
+        # Another session cloned the same sample concurrently; keep theirs.
+        existing = reuse_indexed_voice(digest)
+        if existing is not None:
+            client.voices.delete(voice_id=voice.voice_id)
+            return existing, existing.voice_id
+    return voice, voice.voice_id
 
-    audio = client.generate(
-        text=text,
-        voice=voice,
-        model="eleven_multilingual_v2",
-        voice_settings=VoiceSettings(stability=0.5, similarity_boost=1.0, style=0.7),
-    )
-    output_wav = "/tmp/output.wav"
-    logging.info(output_wav)
-    save(audio, output_wav)
-    logging.info("Finished!")
-    s3 = boto3.client("s3")
-    key = f"{uuid.uuid4()}.wav"
+
+def release_voice(data: dict, voice_id: str):
+    """Undo ``resolve_voice`` for a request that failed before any lease
+    recorded the voice: drop its index reference, and delete the voice if no
+    other session uses it. Errors are logged, not raised."""
+    if data.get("voice_id"):
+        return  # looked up by id: no reference was taken
+    try:
+        if VOICE_DEDUP:
+            digest = data.get("sample_sha256") or voice_index.file_sha256(
+                download_wav_from_s3(data["bucket"], data["key"])
+            )
+            if not voice_index.release(get_leases_table(), digest, voice_id):
+                return
+        get_elevenlabs_client().voices.delete(voice_id=voice_id)
+        logging.info(f"Deleted voice {voice_id} of a failed request")
+    except Exception:
+        logging.exception(f"Could not release voice {voice_id}")
+
+
+def put_speculative_lease(
+    session_id: str, voice_id: str, digest: Optional[str]
+) -> bool:
+    """Lease a voice cloned by /clone before its session starts.
+
+    If Start Chat never claims ``session_id`` (its lease is then overwritten
+    as "active"), the cleanup sweeper deletes the voice once this expires.
+    Returns False if the session had already started, so nothing was leased.
+    """
+    from botocore.exceptions import ClientError
+
+    now = int(time.time())
+    try:
+        get_leases_table().put_item(
+            Item={
+                "session_id": session_id,
+                "el_voice_id": voice_id,
+                "sample_sha256": digest,
+                "status": "speculative",
+                "started_at_epoch": now,
+                "expires_at_epoch": now + SPECULATIVE_TTL,
+            },
+            # never demote a session that already started
+            ConditionExpression="attribute_not_exists(session_id) OR #s = :spec",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={":spec": "speculative"},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return False
+    return True
+
+
+def reuse_indexed_voice(digest: str):
+    """Live voice indexed for ``digest`` (with a reference taken), or None."""
+    from elevenlabs.core import ApiError
+
+    table = get_leases_table()
+    voice_id = voice_index.lookup(table, digest)
+    if not voice_id:
+        return None
+    try:
+        voice = get_elevenlabs_client().voices.get(voice_id)
+    except ApiError as e:
+        if e.status_code not in (400, 404):
+            raise
+        logging.info(f"Indexed voice {voice_id} is gone; cloning again")
+        voice_index.forget(table, digest, voice_id)
+        return None
+    if not voice_index.acquire(table, digest, voice_id):
+        return None
+    logging.info(f"Reusing voice {voice_id} for sample {digest[:12]}")
+    return voice
+
+
+def synthesize(
+    voice, text: str, stream: bool = False, output_format: Optional[str] = None
+) -> Iterator[bytes]:
+    """Generate speech for ``text``; returns an iterator of audio chunks.
+
+    The SDK iterator is lazy, so time spent pulling chunks counts as "generate".
+    Calls are rate limited and retried when ElevenLabs throttles them.
+    """
+
+    def request():
+        return get_elevenlabs_client().generate(
+            text=text,
+            voice=voice,
+            model=TTS_MODEL,
+            voice_settings=get_voice_settings(),
+            stream=stream,
+            output_format=output_format or audio_format()[0],
+        )
+
+    chunks = ratelimit.stream("generate", request)
+    return timing.timed_iter("generate", chunks)
+
+
+def synthesize_bytes(voice, text: str, output_format: Optional[str] = None) -> bytes:
+    return b"".join(synthesize(voice, text, output_format=output_format))
+
+
+def new_audio_key(extension: str = "mp3") -> str:
+    return f"{uuid.uuid4()}.{extension}"
+
+
+def analyze_audio_elevenlabs(data: dict, text: str) -> JSONResponse:
+    """Process and convert audio data using ELEVEN LABS.
+
+    Args:
+        data (dict): The request payload (bucket, key, who, voice_id, ...).
+        text (str): The text to be synthesized.
+    """
+    if data.get("voice_id"):
+        cached = cached_audio_key(data["voice_id"], text, data)
+        if cached:
+            return audio_response(cached, data["voice_id"])
+
+    voice, voice_id = resolve_voice(data)
+    try:
+        key = synthesize_to_s3(voice, voice_id, text, data)
+    except BaseException:
+        release_voice(data, voice_id)
+        raise
+    return audio_response(key, voice_id)
+
+
+def cached_audio_key(voice_id: str, text: str, data: dict) -> Optional[str]:
+    """S3 key of audio already synthesized for this voice, text and format."""
+    output_format = audio_format(data)[0]
+    return cache_get(audio_cache_key(voice_id, text, data["bucket"], output_format))
+
+
+def synthesize_to_s3(voice, voice_id: str, text: str, data: dict) -> str:
+    """Synthesize ``text`` into ``data["bucket"]`` and return the new key."""
     bucket = data["bucket"]
-    s3.upload_file("/tmp/output.wav", bucket, key)
-    return JSONResponse(
-        content={
+    output_format, extension, content_type = audio_format(data)
+    audio = synthesize(voice, text, output_format=output_format)
+    key = new_audio_key(extension)
+    size = upload_audio_to_s3(audio, bucket, key, content_type)
+    logging.info(f"Uploaded {size} bytes ({output_format}) to s3://{bucket}/{key}")
+    cache_set(audio_cache_key(voice_id, text, bucket, output_format), key)
+    return key
+
+
+def audio_response(key: str, voice_id: str) -> JSONResponse:
+    """JSON reply for /tts."""
+    return timed_json({"statusCode": 200, "audio_key": key, "voice_id": voice_id})
+
+
+def batch_response(keys: list, voice_id: str, errors: dict) -> JSONResponse:
+    """JSON reply for /tts/batch: one audio key per text, in order (None if it
+    failed; ``errors`` maps its index to the reason)."""
+    return timed_json(
+        {
             "statusCode": 200,
-            "audio_key": key,
+            "audio_keys": keys,
             "voice_id": voice_id,
+            "errors": errors,
         }
     )
 
 
+def timed_json(content: dict) -> JSONResponse:
+    """JSONResponse with the request's stage timings when it is timed."""
+    headers = {}
+    timer = timing.current()
+    if timer is not None:
+        content["timings"] = timer.as_dict()
+        headers["Server-Timing"] = timer.server_timing()
+    return JSONResponse(content=content, headers=headers)
+
+
 def get_presigned_url(bucket, key, expires_in=3600):
-    s3 = boto3.client("s3")
+    s3 = get_s3_client()
     return s3.generate_presigned_url(
         "get_object",
         Params={"Bucket": bucket, "Key": key},
@@ -1,21 +1,41 @@
 # cleanup_session.py
-import os, json, time
-from typing import Iterable, List
+import os, json, time, random
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
 from dotenv import load_dotenv
 import boto3
+import httpx
+from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 from elevenlabs import ElevenLabs
+from elevenlabs.core import ApiError
+import voice_index
 
 load_dotenv()
 
 DDB_TABLE = os.environ.get("LEASES_TABLE", "leases")  # set in TF env
+TURNS_TABLE = os.environ.get("CHAT_TURNS_TABLE", "chat_turns")
 ELEVEN_API_KEY = os.environ["ELEVEN_API_KEY"]  # set in TF env
+# Point at DynamoDB Local (e.g. http://localhost:8000) to exercise the sweeper offline
+DDB_ENDPOINT_URL = os.environ.get("DYNAMODB_ENDPOINT_URL") or None
 
-dynamodb = boto3.resource("dynamodb")
+dynamodb = boto3.resource("dynamodb", endpoint_url=DDB_ENDPOINT_URL)
 leases = dynamodb.Table(DDB_TABLE)
+turns = dynamodb.Table(TURNS_TABLE)
 
 client = ElevenLabs(api_key=ELEVEN_API_KEY)
 
+# Voice deletion: bounded worker pool, exponential backoff with full jitter
+DELETE_WORKERS = int(os.environ.get("DELETE_WORKERS", 8))
+DELETE_MAX_ATTEMPTS = int(os.environ.get("DELETE_MAX_ATTEMPTS", 5))
+DELETE_BASE_DELAY = float(os.environ.get("DELETE_BASE_DELAY", 0.5))  # seconds
+DELETE_MAX_DELAY = float(os.environ.get("DELETE_MAX_DELAY", 8.0))  # seconds
+
+# Sweeper: leases past expires_at_epoch, found through the by_status GSI
+SWEEP_INDEX = "by_status"
+SWEEP_STATUSES = ("active", "ended", "expired", "speculative")
+SWEEP_BATCH_SIZE = int(os.environ.get("SWEEP_BATCH_SIZE", 200))
+
 
 def _as_list(x) -> List[str]:
     if x is None:
@@ -27,53 +47,245 @@ def _as_list(x) -> List[str]:
     return []
 
 
-def delete_voices(voice_ids: List[str]):
-    deleted, failed = [], {}
-    for vid in set(voice_ids):  # dedupe
-        if not vid:
-            continue
+def _retryable(e: Exception) -> bool:
+    """Throttling, upstream 5xx and transport errors are worth retrying."""
+    if isinstance(e, ApiError):
+        return e.status_code == 429 or (e.status_code or 0) >= 500
+    return isinstance(e, httpx.TransportError)
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(DELETE_MAX_DELAY, DELETE_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+def delete_voice(vid: str, deadline: Optional[float] = None) -> dict:
+    """
+    Delete one voice, retrying throttled/5xx calls until DELETE_MAX_ATTEMPTS or
+    the deadline (epoch seconds). Returns a per-voice outcome record.
+    """
+    start = time.perf_counter()
+    attempt = 0
+    while True:
+        attempt += 1
         try:
             client.voices.delete(voice_id=vid)
-            deleted.append(vid)
+            outcome, error = "deleted", None
         except Exception as e:
-            failed[vid] = str(e)
-    return deleted, failed
+            if isinstance(e, ApiError) and e.status_code == 404:
+                outcome, error = "not_found", None  # already gone
+            else:
+                delay = _backoff(attempt)
+                in_time = deadline is None or time.time() + delay < deadline
+                if _retryable(e) and attempt < DELETE_MAX_ATTEMPTS and in_time:
+                    time.sleep(delay)
+                    continue
+                outcome, error = "failed", str(e)
+        return {
+            "voice_id": vid,
+            "outcome": outcome,
+            "attempts": attempt,
+            "ms": round((time.perf_counter() - start) * 1000, 1),
+            "error": error,
+        }
 
 
-def delete_lease(session_id: str):
+def delete_voices(voice_ids: List[str], deadline: Optional[float] = None):
+    """
+    Delete voices concurrently on a bounded worker pool.
+    Returns (deleted ids, {failed id: error}, per-voice outcome records).
+    """
+    ids = [vid for vid in dict.fromkeys(voice_ids) if vid]  # dedupe, keep order
+    if not ids:
+        return [], {}, []
+    with ThreadPoolExecutor(max_workers=min(DELETE_WORKERS, len(ids))) as pool:
+        results = list(pool.map(lambda vid: delete_voice(vid, deadline), ids))
+    deleted = [r["voice_id"] for r in results if r["outcome"] != "failed"]
+    failed = {r["voice_id"]: r["error"] for r in results if r["outcome"] == "failed"}
+    return deleted, failed, results
+
+
+def release_shared_voices(voice_ids: List[str], sample_sha256: str, table=None):
+    """
+    Drop this session's reference on deduplicated voices (see voice_index).
+    Returns (voice ids safe to delete, voice ids still used by other sessions).
+    """
+    if not sample_sha256:
+        return voice_ids, []
+    deletable, shared = [], []
+    for vid in voice_ids:
+        if voice_index.release(table or leases, sample_sha256, vid):
+            deletable.append(vid)
+        else:
+            shared.append(vid)
+    return deletable, shared
+
+
+def claim_lease(session_id: str):
+    """Delete the lease row; only the caller that removed it cleans the session."""
     if not session_id:
         return {"deleted": False, "reason": "no_session_id"}
     try:
-        # Idempotent: delete if exists
-        leases.delete_item(Key={"session_id": session_id})
-        return {"deleted": True}
+        resp = leases.delete_item(
+            Key={"session_id": session_id},
+            ConditionExpression="attribute_exists(session_id)",
+            ReturnValues="ALL_OLD",
+        )
+        return {"deleted": True, "item": resp.get("Attributes", {})}
     except ClientError as e:
-        return {"deleted": False, "reason": e.response["Error"]["Message"]}
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return {"deleted": False, "reason": "not_found"}
+        raise  # let the scheduler retry the event
+
+
+def find_expired(table, now: int, limit: int) -> List[dict]:
+    """Leases whose expires_at_epoch has passed, oldest first, up to ``limit``."""
+    expired = []
+    for status in SWEEP_STATUSES:
+        kwargs = {
+            "IndexName": SWEEP_INDEX,
+            "KeyConditionExpression": Key("status").eq(status)
+            & Key("expires_at_epoch").lte(now),
+        }
+        while len(expired) < limit:
+            resp = table.query(Limit=limit - len(expired), **kwargs)
+            expired.extend(resp["Items"])
+            if "LastEvaluatedKey" not in resp:
+                break
+            kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+    return expired[:limit]
+
 
+def delete_turns(table, session_ids: List[str]) -> int:
+    """Batch-delete the chat turns of the given sessions; returns items removed."""
+    removed = 0
+    with table.batch_writer() as batch:
+        for sid in session_ids:
+            kwargs = {
+                "KeyConditionExpression": Key("session_id").eq(sid),
+                "ProjectionExpression": "session_id, turn",
+            }
+            while True:
+                resp = table.query(**kwargs)
+                for item in resp["Items"]:
+                    batch.delete_item(Key={"session_id": sid, "turn": item["turn"]})
+                    removed += 1
+                if "LastEvaluatedKey" not in resp:
+                    break
+                kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+    return removed
 
-def handler(event, _context):
+
+def sweep(
+    now: Optional[int] = None,
+    limit: int = SWEEP_BATCH_SIZE,
+    deadline: Optional[float] = None,
+    leases_table=None,
+    turns_table=None,
+):
+    """
+    Clean up every expired lease in one batch: release/delete their voices,
+    then batch-delete the lease rows and their chat turns. Leases whose voice
+    deletion failed are kept so the next sweep retries them.
+    """
+    leases_table = leases_table or leases
+    turns_table = turns_table or turns
+    now = int(now if now is not None else time.time())
+    expired = find_expired(leases_table, now, limit)
+
+    voice_owner, shared = {}, []
+    for lease in expired:
+        vids = _as_list(lease.get("el_voice_id"))
+        deletable, still_used = release_shared_voices(
+            vids, lease.get("sample_sha256"), table=leases_table
+        )
+        shared.extend(still_used)
+        for vid in deletable:
+            voice_owner.setdefault(vid, []).append(lease["session_id"])
+
+    deleted, failed, timings = delete_voices(list(voice_owner), deadline)
+    retry_later = {sid for vid in failed for sid in voice_owner[vid]}
+    done = [l["session_id"] for l in expired if l["session_id"] not in retry_later]
+
+    with leases_table.batch_writer() as batch:
+        for sid in done:
+            batch.delete_item(Key={"session_id": sid})
+    turns_removed = delete_turns(turns_table, done)
+
+    return {
+        "ok": True,
+        "mode": "sweep",
+        "expired": len(expired),
+        "sessions_cleaned": done,
+        "sessions_retry": sorted(retry_later),
+        "turns_deleted": turns_removed,
+        "elevenlabs": {
+            "deleted": deleted,
+            "failed": failed,
+            "shared": shared,
+            "voices": timings,
+        },
+        "ts": int(time.time()),
+    }
+
+
+def _is_sweep(event) -> bool:
+    return event.get("mode") == "sweep" or event.get("detail-type") == "Scheduled Event"
+
+
+def handler(event, context):
     """
+    Sweeper mode: {"mode": "sweep"} (or a plain EventBridge scheduled event)
+    cleans every lease whose expires_at_epoch has passed, in batches.
+
     Expected event shape from EventBridge Scheduler (your UI sets this):
     {
       "session_id": "sess_123",           # or "lease_id"
       "voice_ids": ["v1", "v2", ...],     # optional; can also be a single string "voice_id"
-      "due_epoch": 1725600000             # optional – informational
+      "due_epoch": 1725600000,            # optional – informational
+      "sample_sha256": "ab12..."          # optional; read from the lease if absent
     }
     """
+    # leave a few seconds of the Lambda timeout for the DynamoDB calls
+    deadline = None
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        deadline = time.time() + context.get_remaining_time_in_millis() / 1000 - 5
+
+    if _is_sweep(event):
+        return sweep(limit=int(event.get("limit", SWEEP_BATCH_SIZE)), deadline=deadline)
+
     # Accept both keys
     session_id = event.get("session_id") or event.get("lease_id")
     voice_ids = _as_list(event.get("voice_ids") or event.get("voice_id"))
+    sample_sha256 = event.get("sample_sha256")
 
-    # 1) Delete ElevenLabs voices (if provided)
-    deleted, failed = delete_voices(voice_ids)
+    # 1) Take the lease row. If the sweeper (or an earlier event) already
+    # cleaned this session, its voice references were released then, and
+    # releasing them again would drop one that another session holds.
+    lease_res = claim_lease(session_id)
+    if session_id and not lease_res["deleted"]:
+        return {
+            "ok": True,
+            "session_id": session_id,
+            "skipped": "lease already cleaned",
+            "lease": lease_res,
+            "ts": int(time.time()),
+        }
+    sample_sha256 = sample_sha256 or lease_res.get("item", {}).get("sample_sha256")
+    lease_res.pop("item", None)
 
-    # 2) Delete/cleanup the lease row in DynamoDB
-    lease_res = delete_lease(session_id)
+    # 2) Delete ElevenLabs voices (if provided) that no other session still uses
+    voice_ids, shared = release_shared_voices(voice_ids, sample_sha256)
+    deleted, failed, timings = delete_voices(voice_ids, deadline)
 
     return {
         "ok": True,
         "session_id": session_id,
-        "elevenlabs": {"deleted": deleted, "failed": failed},
+        "elevenlabs": {
+            "deleted": deleted,
+            "failed": failed,
+            "shared": shared,
+            "voices": timings,
+        },
         "lease": lease_res,
         "ts": int(time.time()),
     }
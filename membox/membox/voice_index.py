@@ -0,0 +1,123 @@
+"""Content-hash index from a reference sample to its live ElevenLabs voice.
+
+Index rows live in the leases table under ``session_id = "sample#<sha256>"``
+and carry the cloned ``el_voice_id`` plus a ``ref_count`` of the sessions
+using it. Sessions restarted with the same sample reuse the voice instead of
+cloning again; cleanup only deletes the voice once the last reference is
+released.
+"""
+import hashlib
+import time
+from typing import Optional
+
+from botocore.exceptions import ClientError
+
+INDEX_PREFIX = "sample#"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def index_key(digest: str) -> dict:
+    return {"session_id": f"{INDEX_PREFIX}{digest}"}
+
+
+def _condition_failed(e: ClientError) -> bool:
+    return e.response["Error"]["Code"] == "ConditionalCheckFailedException"
+
+
+def lookup(table, digest: str) -> Optional[str]:
+    """Voice id currently indexed for ``digest``, if any."""
+    item = table.get_item(Key=index_key(digest), ConsistentRead=True).get("Item")
+    return item.get("el_voice_id") if item else None
+
+
+def acquire(table, digest: str, voice_id: str) -> bool:
+    """Add a reference to an indexed voice; False if the index no longer points at it."""
+    try:
+        table.update_item(
+            Key=index_key(digest),
+            UpdateExpression="ADD ref_count :one",
+            ConditionExpression="el_voice_id = :vid",
+            ExpressionAttributeValues={":one": 1, ":vid": voice_id},
+        )
+        return True
+    except ClientError as e:
+        if _condition_failed(e):
+            return False
+        raise
+
+
+def register(table, digest: str, voice_id: str) -> bool:
+    """Index a freshly cloned voice with one reference.
+
+    Returns False if another request indexed a voice for ``digest`` first.
+    """
+    try:
+        table.put_item(
+            Item={
+                **index_key(digest),
+                "el_voice_id": voice_id,
+                "sample_sha256": digest,
+                "ref_count": 1,
+                "created_at_epoch": int(time.time()),
+            },
+            ConditionExpression="attribute_not_exists(session_id)",
+        )
+        return True
+    except ClientError as e:
+        if _condition_failed(e):
+            return False
+        raise
+
+
+def forget(table, digest: str, voice_id: str):
+    """Drop the index row for a voice that no longer exists upstream."""
+    try:
+        table.delete_item(
+            Key=index_key(digest),
+            ConditionExpression="el_voice_id = :vid",
+            ExpressionAttributeValues={":vid": voice_id},
+        )
+    except ClientError as e:
+        if not _condition_failed(e):
+            raise
+
+
+def release(table, digest: str, voice_id: str) -> bool:
+    """Drop one reference to ``voice_id``.
+
+    Returns True when the caller may delete the voice: either nobody else
+    references it any more, or it was never indexed under ``digest``.
+    """
+    try:
+        resp = table.update_item(
+            Key=index_key(digest),
+            UpdateExpression="ADD ref_count :minus_one",
+            ConditionExpression="el_voice_id = :vid",
+            ExpressionAttributeValues={":minus_one": -1, ":vid": voice_id},
+            ReturnValues="UPDATED_NEW",
+        )
+    except ClientError as e:
+        if _condition_failed(e):
+            return True
+        raise
+    if int(resp["Attributes"]["ref_count"]) > 0:
+        return False
+    # Only remove the row if nobody re-acquired the voice in the meantime.
+    try:
+        table.delete_item(
+            Key=index_key(digest),
+            ConditionExpression="el_voice_id = :vid AND ref_count <= :zero",
+            ExpressionAttributeValues={":vid": voice_id, ":zero": 0},
+        )
+        return True
+    except ClientError as e:
+        if _condition_failed(e):
+            return False
+        raise
@@ -0,0 +1,161 @@
+import importlib.util
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import boto3
+import httpx
+import pytest
+from moto import mock_aws
+
+PACKAGE_DIR = Path(__file__).resolve().parents[1] / "membox"
+BENCH_DIR = Path(__file__).resolve().parents[1] / "benchmarks"
+BUCKET = "test-bucket"
+SAMPLE_KEY = "sample.wav"
+
+# The modules read these at import time; never talk to real services.
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("ELEVEN_API_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("CACHE_BACKEND", "local")
+sys.path.insert(0, str(PACKAGE_DIR))
+sys.path.insert(0, str(BENCH_DIR))
+
+
+@pytest.fixture
+def dynamodb():
+    with mock_aws():
+        yield boto3.resource("dynamodb", region_name="us-east-1")
+
+
+@pytest.fixture
+def leases_table(dynamodb):
+    """Same keys and by_status index as terraform/dynamo_db.tf."""
+    return dynamodb.create_table(
+        TableName="leases",
+        KeySchema=[{"AttributeName": "session_id", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            {"AttributeName": "session_id", "AttributeType": "S"},
+            {"AttributeName": "status", "AttributeType": "S"},
+            {"AttributeName": "expires_at_epoch", "AttributeType": "N"},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "by_status",
+                "KeySchema": [
+                    {"AttributeName": "status", "KeyType": "HASH"},
+                    {"AttributeName": "expires_at_epoch", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+@pytest.fixture
+def turns_table(dynamodb):
+    return dynamodb.create_table(
+        TableName="chat_turns",
+        KeySchema=[
+            {"AttributeName": "session_id", "KeyType": "HASH"},
+            {"AttributeName": "turn", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "session_id", "AttributeType": "S"},
+            {"AttributeName": "turn", "AttributeType": "N"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+@pytest.fixture
+def cache_table(dynamodb):
+    return dynamodb.create_table(
+        TableName="tts_cache",
+        KeySchema=[{"AttributeName": "cache_key", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "cache_key", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+def load(name: str, filename: str):
+    """Import a package module by path; the repo root has its own voice_cleanup."""
+    spec = importlib.util.spec_from_file_location(name, PACKAGE_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    """The FastAPI app module (``__main__.py``), imported without running it."""
+    return load("membox_app", "__main__.py")
+
+
+@pytest.fixture(scope="session")
+def sweeper():
+    """The cleanup Lambda (``voice_cleanup.py``)."""
+    return load("membox_voice_cleanup", "voice_cleanup.py")
+
+
+@pytest.fixture
+def upstreams(monkeypatch):
+    """The benchmark's stand-ins for S3, ElevenLabs and the chat model, with no
+    injected latency. Deleted voice ids are collected in ``deleted``."""
+    import utils
+    from fakes import (
+        FakeChatModel,
+        FakeElevenLabs,
+        FakeS3,
+        Latencies,
+        StageRecorder,
+        fake_wav,
+    )
+
+    latencies = Latencies(
+        s3_download=0, s3_upload=0, llm=0, voice_get=0, clone=0, generate=0, jitter=0
+    )
+    recorder = StageRecorder()
+    s3 = FakeS3(latencies, recorder)
+    s3.objects[(BUCKET, SAMPLE_KEY)] = fake_wav()
+    elevenlabs = FakeElevenLabs(latencies, recorder)
+    deleted = []
+    elevenlabs.voices.delete = lambda voice_id, **_: deleted.append(voice_id)
+    chat_model = FakeChatModel(latencies=latencies, recorder=recorder, sentences=2)
+
+    monkeypatch.setattr(utils, "get_s3_client", lambda: s3)
+    monkeypatch.setattr(utils, "get_elevenlabs_client", lambda: elevenlabs)
+    monkeypatch.setattr(utils, "get_chat_model", lambda: chat_model)
+    monkeypatch.setattr(utils, "VOICE_DEDUP", False)
+    for cached in (utils.get_chain, utils.get_cache, utils.get_idempotency_cache):
+        cached.cache_clear()
+    yield SimpleNamespace(
+        s3=s3, elevenlabs=elevenlabs, recorder=recorder, deleted=deleted
+    )
+    for cached in (utils.get_chain, utils.get_cache, utils.get_idempotency_cache):
+        cached.cache_clear()
+
+
+@pytest.fixture
+def payload():
+    return {
+        "who": "Test",
+        "rs": "friend",
+        "text": "Hello, how are you?",
+        "lang": "en",
+        "voice_id": None,
+        "bucket": BUCKET,
+        "key": SAMPLE_KEY,
+    }
+
+
+@pytest.fixture
+def api(app_module, upstreams):
+    """Async HTTP client bound to the app in-process."""
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app_module.app), base_url="http://test"
+    )
@@ -0,0 +1,100 @@
+import pytest
+
+import ratelimit
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+
+def test_burst_is_free_then_waits_grow_in_arrival_order(clock):
+    bucket = ratelimit.TokenBucket(rate=2, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_tokens_refill_up_to_the_burst(clock):
+    bucket = ratelimit.TokenBucket(rate=2, burst=2)
+    bucket.reserve()
+    bucket.reserve()
+    clock.now += 0.5
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.5)
+
+    clock.now += 60  # idle: never more than the burst
+    assert [bucket.reserve() for _ in range(3)] == pytest.approx([0.0, 0.0, 0.5])
+
+
+def test_cancel_returns_the_token(clock):
+    bucket = ratelimit.TokenBucket(rate=1, burst=1)
+    bucket.reserve()
+    assert bucket.reserve() == pytest.approx(1.0)
+    bucket.cancel()
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_acquire_rejects_waits_past_the_limit(clock, monkeypatch):
+    bucket = ratelimit.TokenBucket(rate=1, burst=1)
+    monkeypatch.setitem(ratelimit._buckets, "clone", bucket)
+    monkeypatch.setattr(ratelimit, "RATE_MAX_WAIT", 0.5)
+
+    ratelimit.acquire("clone")
+    with pytest.raises(ratelimit.Throttled) as raised:
+        ratelimit.acquire("clone")
+    assert raised.value.retry_after == pytest.approx(1.0)
+    # the rejected call gave its token back
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def shared(cache_table, rate=0.001, burst=2):
+    return ratelimit.SharedTokenBucket(lambda: cache_table, "generate", rate, burst)
+
+
+def test_containers_draw_from_one_shared_bucket(cache_table):
+    first, second = shared(cache_table), shared(cache_table)
+
+    assert first.reserve() == 0.0
+    assert second.reserve() == 0.0
+    # the burst is spent across both "containers"
+    assert first.reserve() == pytest.approx(1000, rel=0.01)
+    assert second.reserve() == pytest.approx(2000, rel=0.01)
+
+
+def test_shared_cancel_returns_the_token(cache_table):
+    bucket = shared(cache_table, burst=1)
+    bucket.reserve()
+    assert bucket.reserve() == pytest.approx(1000, rel=0.01)
+    bucket.cancel()
+    assert bucket.reserve() == pytest.approx(1000, rel=0.01)
+
+
+def test_shared_bucket_falls_back_to_the_local_one(clock):
+    def unreachable():
+        raise ConnectionError("no table")
+
+    bucket = ratelimit.SharedTokenBucket(unreachable, "clone", rate=1, burst=1)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_share_swaps_every_bucket(cache_table, monkeypatch):
+    monkeypatch.setattr(
+        ratelimit, "_buckets", {"clone": ratelimit.TokenBucket(rate=5, burst=10)}
+    )
+    ratelimit.share(lambda: cache_table)
+
+    bucket = ratelimit._buckets["clone"]
+    assert isinstance(bucket, ratelimit.SharedTokenBucket)
+    assert (bucket.rate, bucket.capacity) == (5, 10)
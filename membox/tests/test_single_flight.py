@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+import cache
+import utils
+
+
+@pytest.fixture(autouse=True)
+def fresh_idempotency_cache():
+    utils.get_idempotency_cache.cache_clear()
+    yield
+    utils.get_idempotency_cache.cache_clear()
+
+
+async def settle(app_module, key, work):
+    """What the endpoints do: join, compute once, settle the flight."""
+    response, flight = await app_module.join_flight(key)
+    if flight is None:
+        return response.body, False
+    try:
+        content = await work()
+    except BaseException as e:
+        app_module.fail_flight(key, flight, e)
+        raise
+    await app_module.complete_flight(key, flight, content)
+    return content, True
+
+
+def test_duplicates_share_one_computation(app_module):
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"audio": "a.mp3"}
+
+    async def main():
+        return await asyncio.gather(
+            *(settle(app_module, "idem:1", work) for _ in range(3))
+        )
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [computed for _, computed in results].count(True) == 1
+    assert all(b'"a.mp3"' in body for body, computed in results if not computed)
+
+
+def test_a_completed_result_is_replayed(app_module):
+    calls = []
+
+    async def work():
+        calls.append(1)
+        return {"audio": "a.mp3"}
+
+    async def main():
+        first = await settle(app_module, "idem:2", work)
+        second = await settle(app_module, "idem:2", work)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == ({"audio": "a.mp3"}, True)
+    assert second[1] is False
+    assert len(calls) == 1
+
+
+def test_a_failure_reaches_duplicates_and_allows_a_retry(app_module):
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream down")
+
+    async def work():
+        return {"audio": "b.mp3"}
+
+    async def main():
+        outcomes = await asyncio.gather(
+            settle(app_module, "idem:3", fail),
+            settle(app_module, "idem:3", fail),
+            return_exceptions=True,
+        )
+        return outcomes, await settle(app_module, "idem:3", work)
+
+    outcomes, retry = asyncio.run(main())
+    assert all(isinstance(o, RuntimeError) for o in outcomes)
+    assert retry == ({"audio": "b.mp3"}, True)
+
+
+def test_dynamo_claim_is_exclusive_until_released(cache_table):
+    store = cache.DynamoCache(cache_table, ttl_seconds=300)
+    assert store.claim("k", 60)
+    assert not store.claim("k", 60)
+    assert store.lookup("k") == (None, True)
+
+    store.release("k")
+    assert store.claim("k", 60)
+    store.set("k", '{"audio": "c.mp3"}')
+    assert not store.claim("k", 60)
+    assert store.lookup("k") == ('{"audio": "c.mp3"}', False)
+    # a stored result is never dropped as a stale claim
+    store.release("k")
+    assert store.lookup("k")[0] == '{"audio": "c.mp3"}'
+
+
+def test_another_container_waits_for_the_claimed_result(
+    app_module, cache_table, monkeypatch
+):
+    store = cache.DynamoCache(cache_table, ttl_seconds=300)
+    monkeypatch.setattr(utils, "get_idempotency_cache", lambda: store)
+    monkeypatch.setattr(app_module, "IDEMPOTENCY_POLL", 0.01)
+    assert store.claim("idem:4", 60)  # held by "another container"
+
+    async def main():
+        waiter = asyncio.ensure_future(app_module.join_flight("idem:4"))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        store.set("idem:4", '{"audio": "d.mp3"}')
+        return await waiter
+
+    response, flight = asyncio.run(main())
+    assert flight is None
+    assert b'"d.mp3"' in response.body
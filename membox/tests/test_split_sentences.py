@@ -0,0 +1,54 @@
+import pytest
+
+import utils
+
+
+@pytest.fixture(autouse=True)
+def short_sentences(monkeypatch):
+    monkeypatch.setattr(utils, "MIN_SENTENCE_CHARS", 10)
+
+
+def tokens(text, size=3):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def test_sentences_come_out_whole_whatever_the_token_size():
+    text = "Hello there, friend. How have you been? I missed you!"
+    expected = ["Hello there, friend.", "How have you been?", "I missed you!"]
+    for size in (1, 3, 7, len(text)):
+        assert list(utils.split_sentences(tokens(text, size))) == expected
+
+
+def test_a_sentence_is_yielded_before_the_stream_ends():
+    def stream():
+        yield "It works just fine. And"
+        raise AssertionError("read past the first sentence")
+
+    assert next(utils.split_sentences(stream())) == "It works just fine."
+
+
+def test_short_sentences_are_merged():
+    text = "Hi. Yes. That is a longer sentence."
+    assert list(utils.split_sentences(tokens(text))) == [
+        "Hi. Yes. That is a longer sentence."
+    ]
+    assert list(utils.split_sentences(["Hi. Yes. Okay then, done. Ok."])) == [
+        "Hi. Yes. Okay then, done.",
+        "Ok.",
+    ]
+
+
+def test_unterminated_tail_and_empty_stream():
+    assert list(utils.split_sentences(tokens("No full stop here"))) == [
+        "No full stop here"
+    ]
+    assert list(utils.split_sentences([])) == []
+    assert list(utils.split_sentences(["  ", "\n"])) == []
+
+
+def test_arabic_question_mark_ends_a_sentence():
+    text = "كيف حالك اليوم يا صديقي؟ أنا بخير والحمد لله."
+    assert list(utils.split_sentences(tokens(text))) == [
+        "كيف حالك اليوم يا صديقي؟",
+        "أنا بخير والحمد لله.",
+    ]
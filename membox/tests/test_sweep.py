@@ -0,0 +1,151 @@
+import pytest
+
+import voice_index
+
+NOW = 1_700_000_000
+DIGEST = "cd" * 32
+
+
+class FakeVoices:
+    def __init__(self, fail=()):
+        self.deleted = []
+        self.fail = set(fail)
+
+    def delete(self, voice_id):
+        if voice_id in self.fail:
+            raise RuntimeError("upstream down")
+        self.deleted.append(voice_id)
+
+
+class FakeClient:
+    def __init__(self, fail=()):
+        self.voices = FakeVoices(fail)
+
+
+@pytest.fixture
+def client(sweeper, monkeypatch):
+    fake = FakeClient()
+    monkeypatch.setattr(sweeper, "client", fake)
+    return fake
+
+
+def put_lease(table, session_id, voice_id, expires, status="active", **extra):
+    table.put_item(
+        Item={
+            "session_id": session_id,
+            "el_voice_id": voice_id,
+            "status": status,
+            "expires_at_epoch": expires,
+            **extra,
+        }
+    )
+
+
+def put_turns(table, session_id, count):
+    for turn in range(count):
+        table.put_item(Item={"session_id": session_id, "turn": turn, "text": "hi"})
+
+
+@pytest.fixture
+def sweep(sweeper, leases_table, turns_table):
+    def run(now=NOW, **kwargs):
+        return sweeper.sweep(
+            now=now, leases_table=leases_table, turns_table=turns_table, **kwargs
+        )
+
+    return run
+
+
+def test_sweep_cleans_only_expired_leases(client, sweep, leases_table, turns_table):
+    put_lease(leases_table, "old", "v-old", NOW - 60)
+    put_lease(leases_table, "ended", "v-ended", NOW - 1, status="ended")
+    put_lease(leases_table, "live", "v-live", NOW + 600)
+    put_turns(turns_table, "old", 3)
+    put_turns(turns_table, "live", 2)
+
+    result = sweep()
+
+    assert result["expired"] == 2
+    assert sorted(result["sessions_cleaned"]) == ["ended", "old"]
+    assert result["turns_deleted"] == 3
+    assert sorted(client.voices.deleted) == ["v-ended", "v-old"]
+    remaining = {i["session_id"] for i in leases_table.scan()["Items"]}
+    assert remaining == {"live"}
+    assert turns_table.scan()["Count"] == 2
+
+
+def test_sweep_keeps_leases_whose_voice_failed_to_delete(
+    sweeper, sweep, monkeypatch, leases_table
+):
+    monkeypatch.setattr(sweeper, "client", FakeClient(fail={"v-bad"}))
+    monkeypatch.setattr(sweeper, "DELETE_MAX_ATTEMPTS", 1)
+    put_lease(leases_table, "bad", "v-bad", NOW - 60)
+    put_lease(leases_table, "good", "v-good", NOW - 60)
+
+    result = sweep()
+
+    assert result["sessions_cleaned"] == ["good"]
+    assert result["sessions_retry"] == ["bad"]
+    assert list(result["elevenlabs"]["failed"]) == ["v-bad"]
+    remaining = {i["session_id"] for i in leases_table.scan()["Items"]}
+    assert remaining == {"bad"}
+
+
+def test_sweep_keeps_shared_voices_until_the_last_session(
+    client, sweep, leases_table
+):
+    voice_index.register(leases_table, DIGEST, "v-shared")
+    voice_index.acquire(leases_table, DIGEST, "v-shared")
+    put_lease(leases_table, "a", "v-shared", NOW - 60, sample_sha256=DIGEST)
+    put_lease(leases_table, "b", "v-shared", NOW + 600, sample_sha256=DIGEST)
+
+    result = sweep()
+    assert result["sessions_cleaned"] == ["a"]
+    assert result["elevenlabs"]["shared"] == ["v-shared"]
+    assert client.voices.deleted == []
+
+    result = sweep(now=NOW + 601)
+    assert result["sessions_cleaned"] == ["b"]
+    assert client.voices.deleted == ["v-shared"]
+    assert voice_index.lookup(leases_table, DIGEST) is None
+
+
+def test_sweep_respects_the_batch_limit(client, sweep, leases_table):
+    for i in range(5):
+        put_lease(leases_table, f"s{i}", f"v{i}", NOW - 100 + i)
+
+    result = sweep(limit=3)
+
+    assert result["sessions_cleaned"] == ["s0", "s1", "s2"]
+    assert leases_table.scan()["Count"] == 2
+
+
+def test_a_late_session_event_after_the_sweep_is_a_no_op(
+    sweeper, client, sweep, monkeypatch, leases_table
+):
+    monkeypatch.setattr(sweeper, "leases", leases_table)
+    voice_index.register(leases_table, DIGEST, "v-shared")
+    voice_index.acquire(leases_table, DIGEST, "v-shared")
+    put_lease(leases_table, "a", "v-shared", NOW - 60, sample_sha256=DIGEST)
+    put_lease(leases_table, "b", "v-shared", NOW + 600, sample_sha256=DIGEST)
+    sweep()
+
+    # CLEANUP_MODE=schedule: a's own schedule fires after the sweeper cleaned it
+    event = {"session_id": "a", "voice_ids": ["v-shared"], "sample_sha256": DIGEST}
+    result = sweeper.handler(event, None)
+
+    assert result["skipped"] == "lease already cleaned"
+    assert client.voices.deleted == []
+    assert voice_index.lookup(leases_table, DIGEST) == "v-shared"
+
+
+def test_a_session_event_cleans_its_lease_once(
+    sweeper, client, monkeypatch, leases_table
+):
+    monkeypatch.setattr(sweeper, "leases", leases_table)
+    put_lease(leases_table, "a", "v-a", NOW + 600)
+    event = {"session_id": "a", "voice_ids": ["v-a"]}
+
+    assert sweeper.handler(event, None)["elevenlabs"]["deleted"] == ["v-a"]
+    assert "skipped" in sweeper.handler(event, None)
+    assert client.voices.deleted == ["v-a"]
@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+import pytest
+
+
+def form(payload):
+    return {"data": json.dumps(payload)}
+
+
+def test_player_stream_and_post_share_one_request(api, upstreams, payload):
+    payload["idempotency_key"] = "session:0"
+
+    async def main():
+        async with api:
+            return await asyncio.gather(
+                api.get("/tts/stream", params=form(payload)),
+                api.post("/tts", data=form(payload)),
+            )
+
+    stream, reply = asyncio.run(main())
+    assert stream.status_code == 200
+    assert stream.headers["content-type"].startswith("audio/")
+    assert reply.status_code == 200
+    assert reply.headers["Idempotent-Replayed"] == "true"
+    assert reply.json()["audio_key"] == stream.headers["X-Audio-Key"]
+    assert len(upstreams.recorder.snapshot()["clone"]) == 1
+    stored = upstreams.s3.objects[(payload["bucket"], stream.headers["X-Audio-Key"])]
+    assert stored == stream.content
+
+
+def test_player_is_redirected_to_a_stored_reply(api, upstreams, payload):
+    payload["idempotency_key"] = "session:1"
+
+    async def main():
+        async with api:
+            reply = await api.post("/tts", data=form(payload))
+            stream = await api.get("/tts/stream", params=form(payload))
+            return reply, stream
+
+    reply, stream = asyncio.run(main())
+    assert stream.status_code == 307
+    assert reply.json()["audio_key"] in stream.headers["location"]
+
+
+def test_a_failed_stream_gives_its_cloned_voice_back(api, upstreams, payload):
+    generate = upstreams.elevenlabs.generate
+
+    def broken(text, **kwargs):
+        chunks = generate(text, **kwargs)
+        yield next(chunks)
+        raise RuntimeError("connection reset")
+
+    upstreams.elevenlabs.generate = broken
+
+    async def main():
+        async with api:
+            return await api.post("/tts/stream", data=form(payload))
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main())
+    assert len(upstreams.deleted) == 1
+
+
+def test_a_rejected_stream_lets_its_retry_run(api, app_module, upstreams, payload):
+    import ratelimit
+
+    payload["idempotency_key"] = "session:2"
+    tts_slots = app_module.tts_slots
+    app_module.tts_slots = lambda: ratelimit.AdmissionQueue(0, 0)
+
+    async def main():
+        async with api:
+            busy = await api.post("/tts/stream", data=form(payload))
+            app_module.tts_slots = tts_slots
+            retry = await asyncio.wait_for(
+                api.post("/tts/stream", data=form(payload)), timeout=5
+            )
+            return busy, retry
+
+    try:
+        busy, retry = asyncio.run(main())
+    finally:
+        app_module.tts_slots = tts_slots
+    assert busy.status_code == 503
+    assert retry.status_code == 200
+    assert "Idempotent-Replayed" not in retry.headers
+
+
+def test_a_bad_bitrate_lets_its_retry_run(api, upstreams, payload):
+    payload["idempotency_key"] = "session:3"
+
+    async def main():
+        async with api:
+            with pytest.raises(ValueError):
+                await api.post("/tts/stream", data=form({**payload, "bitrate": "high"}))
+            return await asyncio.wait_for(
+                api.post("/tts/stream", data=form(payload)), timeout=5
+            )
+
+    retry = asyncio.run(main())
+    assert retry.status_code == 200
@@ -0,0 +1,49 @@
+import hashlib
+
+import voice_index
+
+DIGEST = "ab" * 32
+
+
+def test_register_then_lookup(leases_table):
+    assert voice_index.register(leases_table, DIGEST, "v1")
+    assert voice_index.lookup(leases_table, DIGEST) == "v1"
+    # a second clone of the same sample loses the race
+    assert not voice_index.register(leases_table, DIGEST, "v2")
+    assert voice_index.lookup(leases_table, DIGEST) == "v1"
+
+
+def test_voice_is_deletable_after_the_last_release(leases_table):
+    voice_index.register(leases_table, DIGEST, "v1")
+    assert voice_index.acquire(leases_table, DIGEST, "v1")
+
+    assert not voice_index.release(leases_table, DIGEST, "v1")
+    assert voice_index.lookup(leases_table, DIGEST) == "v1"
+    assert voice_index.release(leases_table, DIGEST, "v1")
+    assert voice_index.lookup(leases_table, DIGEST) is None
+
+
+def test_acquire_requires_the_indexed_voice(leases_table):
+    assert not voice_index.acquire(leases_table, DIGEST, "v1")
+    voice_index.register(leases_table, DIGEST, "v1")
+    assert not voice_index.acquire(leases_table, DIGEST, "other")
+
+
+def test_release_of_an_unindexed_voice_allows_delete(leases_table):
+    voice_index.register(leases_table, DIGEST, "v1")
+    assert voice_index.release(leases_table, DIGEST, "other")
+    assert voice_index.lookup(leases_table, DIGEST) == "v1"
+
+
+def test_forget_only_drops_the_matching_voice(leases_table):
+    voice_index.register(leases_table, DIGEST, "v1")
+    voice_index.forget(leases_table, DIGEST, "other")
+    assert voice_index.lookup(leases_table, DIGEST) == "v1"
+    voice_index.forget(leases_table, DIGEST, "v1")
+    assert voice_index.lookup(leases_table, DIGEST) is None
+
+
+def test_file_sha256(tmp_path):
+    path = tmp_path / "sample.wav"
+    path.write_bytes(b"RIFF" * 1000)
+    assert voice_index.file_sha256(str(path)) == hashlib.sha256(b"RIFF" * 1000).hexdigest()
@@ -42,3 +42,39 @@ resource "aws_dynamodb_table" "leases" {
     projection_type = "ALL"
   }
 }
+
+resource "aws_dynamodb_table" "tts_cache" {
+  name         = "tts_cache"
+  hash_key     = "cache_key"
+  billing_mode = "PAY_PER_REQUEST"
+  attribute {
+    name = "cache_key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at_epoch"
+    enabled        = true
+  }
+}
+
+resource "aws_dynamodb_table" "chat_turns" {
+  name         = "chat_turns"
+  hash_key     = "session_id"
+  range_key    = "turn"
+  billing_mode = "PAY_PER_REQUEST"
+  attribute {
+    name = "session_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "turn"
+    type = "N"
+  }
+
+  ttl {
+    attribute_name = "expires_at_epoch"
+    enabled        = true
+  }
+}
@@ -49,6 +49,28 @@ resource "aws_lambda_permission" "allow_scheduler_cleanup" {
   principal     = "scheduler.amazonaws.com"
 }
 
+# 4) Batched expiry sweeper: one schedule for all sessions instead of one per session
+resource "aws_scheduler_schedule" "lease_sweeper" {
+  name                = "membox-lease-sweeper"
+  group_name          = aws_scheduler_schedule_group.sessions.name
+  schedule_expression = "rate(1 minute)"
+
+  flexible_time_window {
+    mode = "OFF"
+  }
+
+  target {
+    arn      = aws_lambda_function.cleanup.arn
+    role_arn = aws_iam_role.scheduler_invoke_cleanup.arn
+    input    = jsonencode({ mode = "sweep" })
+
+    retry_policy {
+      maximum_event_age_in_seconds = 60
+      maximum_retry_attempts       = 0
+    }
+  }
+}
+
 # (Optional but recommended) Output handy values for your Streamlit app
 output "scheduler_group_name" {
   value = aws_scheduler_schedule_group.sessions.name
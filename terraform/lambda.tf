@@ -29,6 +29,43 @@ resource "aws_iam_role_policy_attachment" "lambda_api_s3_attach" {
   policy_arn = aws_iam_policy.lambda_api_s3.arn
 }
 
+data "aws_iam_policy_document" "lambda_api_cache_doc" {
+  statement {
+    actions = [
+      "dynamodb:GetItem",
+      "dynamodb:PutItem",
+      "dynamodb:UpdateItem", # returning a shared rate-limit token
+      "dynamodb:DeleteItem"  # dropping a failed request's idempotency claim
+    ]
+    resources = [
+      aws_dynamodb_table.tts_cache.arn
+    ]
+  }
+
+  # sample-digest -> voice index rows (voice clone dedupe)
+  statement {
+    actions = [
+      "dynamodb:GetItem",
+      "dynamodb:PutItem",
+      "dynamodb:UpdateItem",
+      "dynamodb:DeleteItem"
+    ]
+    resources = [
+      aws_dynamodb_table.leases.arn
+    ]
+  }
+}
+
+resource "aws_iam_policy" "lambda_api_cache" {
+  name   = "lambda_api_cache_access"
+  policy = data.aws_iam_policy_document.lambda_api_cache_doc.json
+}
+
+resource "aws_iam_role_policy_attachment" "lambda_api_cache_attach" {
+  role       = aws_iam_role.lambda_api.name
+  policy_arn = aws_iam_policy.lambda_api_cache.arn
+}
+
 resource "aws_iam_role" "lambda_cleanup" {
   name = "lambda_cleanup"
   assume_role_policy = jsonencode({
@@ -47,10 +84,14 @@ data "aws_iam_policy_document" "lambda_cleanup_ddb_doc" {
     actions = [
       "dynamodb:GetItem",
       "dynamodb:DeleteItem",
-      "dynamodb:UpdateItem"
+      "dynamodb:UpdateItem",
+      "dynamodb:Query",
+      "dynamodb:BatchWriteItem"
     ]
     resources = [
-      aws_dynamodb_table.leases.arn
+      aws_dynamodb_table.leases.arn,
+      "${aws_dynamodb_table.leases.arn}/index/by_status",
+      aws_dynamodb_table.chat_turns.arn
     ]
   }
 }
@@ -82,6 +123,15 @@ resource "aws_cloudwatch_log_group" "cleanup" {
 ############################
 # Lambdas (images + digests)
 ############################
+# Optional hard cap on concurrent API containers (reserved concurrency); -1
+# leaves it unreserved. Upstream quotas are enforced by the shared token buckets
+# (RATE_LIMIT_BACKEND=dynamodb) whatever the fleet size. Requests over a cap get
+# HTTP 429, which the app retries.
+variable "api_max_concurrency" {
+  type    = number
+  default = -1
+}
+
 resource "aws_lambda_function" "api" {
   function_name    = "lambda_tts"
   role             = aws_iam_role.lambda_api.arn
@@ -92,7 +142,15 @@ resource "aws_lambda_function" "api" {
   timeout          = 240
   memory_size      = 1024
 
-  environment { variables = {} }
+  reserved_concurrent_executions = var.api_max_concurrency
+
+  environment {
+    variables = {
+      CACHE_BACKEND      = "dynamodb"
+      CACHE_TABLE        = aws_dynamodb_table.tts_cache.name
+      RATE_LIMIT_BACKEND = "dynamodb"
+    }
+  }
 
   depends_on = [
     null_resource.image_api,
@@ -110,7 +168,7 @@ resource "aws_lambda_function_url" "api" {
     allow_origins     = ["*"]
     allow_methods     = ["*"]
     allow_headers     = ["data", "keep-alive"]
-    expose_headers    = ["keep-alive", "date"]
+    expose_headers    = ["keep-alive", "date", "x-audio-key", "x-voice-id"]
     max_age           = 86400
   }
 }
@@ -125,6 +183,13 @@ resource "aws_lambda_function" "cleanup" {
   timeout          = 120
   memory_size      = 512
 
+  environment {
+    variables = {
+      LEASES_TABLE     = aws_dynamodb_table.leases.name
+      CHAT_TURNS_TABLE = aws_dynamodb_table.chat_turns.name
+    }
+  }
+
   depends_on = [
     null_resource.image_cleanup,
     aws_iam_role_policy_attachment.lambda_cleanup_logs,
@@ -0,0 +1,166 @@
+import importlib.util
+import os
+from pathlib import Path
+
+import boto3
+import pytest
+from moto import mock_aws
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+spec = importlib.util.spec_from_file_location(
+    "session_cleanup", Path(__file__).resolve().parents[1] / "voice_cleanup.py"
+)
+voice_cleanup = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(voice_cleanup)
+voice_index = voice_cleanup.voice_index
+
+DIGEST = "ef" * 32
+
+
+class FakeVoices:
+    def __init__(self, fail=()):
+        self.deleted = []
+        self.fail = set(fail)
+
+    def delete(self, voice_id):
+        if voice_id in self.fail:
+            raise RuntimeError("upstream down")
+        self.deleted.append(voice_id)
+
+
+class FakeClient:
+    def __init__(self, fail=()):
+        self.voices = FakeVoices(fail)
+
+
+@pytest.fixture
+def leases():
+    with mock_aws():
+        yield boto3.resource("dynamodb", region_name="us-east-1").create_table(
+            TableName="leases",
+            KeySchema=[{"AttributeName": "session_id", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "session_id", "AttributeType": "S"},
+                {"AttributeName": "status", "AttributeType": "S"},
+                {"AttributeName": "expires_at_epoch", "AttributeType": "N"},
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    "IndexName": "by_status",
+                    "KeySchema": [
+                        {"AttributeName": "status", "KeyType": "HASH"},
+                        {"AttributeName": "expires_at_epoch", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                }
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+
+def session(expires, voice_ids=()):
+    return {"expires_at_epoch": expires, "voice_ids": list(voice_ids)}
+
+
+def put_lease(table, sid, voice_id, expires, status="active", **extra):
+    table.put_item(
+        Item={
+            "session_id": sid,
+            "el_voice_id": voice_id,
+            "status": status,
+            "expires_at_epoch": expires,
+            **extra,
+        }
+    )
+
+
+def test_sessions_expire_in_deadline_order():
+    queue = voice_cleanup.DeadlineQueue()
+    queue.sync({"b": session(200, ["vb"]), "a": session(100, ["va"]), "c": session(300)})
+
+    assert queue.next_deadline() == 100
+    assert queue.pop_expired(99) == []
+    assert queue.pop_expired(200) == ["a", "b"]
+    assert queue.sessions["a"]["voice_ids"] == ["va"]
+    assert queue.next_deadline() == 300
+
+
+def test_an_extended_lease_moves_its_deadline():
+    queue = voice_cleanup.DeadlineQueue()
+    queue.sync({"a": session(100)})
+    queue.sync({"a": session(500)})
+
+    assert queue.pop_expired(100) == []
+    assert queue.pop_expired(500) == ["a"]
+    assert queue.next_deadline() is None
+
+
+def test_removed_sessions_are_dropped():
+    queue = voice_cleanup.DeadlineQueue()
+    queue.sync({"a": session(100), "b": session(200)})
+    queue.sync({"b": session(200)})
+
+    assert "a" not in queue.sessions
+    assert queue.pop_expired(10**9) == ["b"]
+
+
+def test_malformed_entries_are_skipped():
+    queue = voice_cleanup.DeadlineQueue()
+    queue.sync({"bad": {"voice_ids": ["v"]}, "worse": {"expires_at_epoch": "x"}, "a": session(1)})
+
+    assert queue.pop_expired(10**9) == ["a"]
+
+
+def test_a_failed_session_is_retried_later_despite_syncs():
+    queue = voice_cleanup.DeadlineQueue()
+    queue.sync({"a": session(100)})
+    assert queue.pop_expired(100) == ["a"]
+
+    queue.retry("a", 130)
+    queue.sync({"a": session(100)})  # the lease is still there
+    assert queue.pop_expired(129) == []
+    assert queue.pop_expired(130) == ["a"]
+
+
+def test_sessions_come_from_the_leases_table(leases):
+    put_lease(leases, "a", "va", 100, sample_sha256=DIGEST)
+    put_lease(leases, "b", "vb", 200, status="speculative")
+    voice_index.register(leases, DIGEST, "va")  # index rows are not sessions
+
+    sessions = voice_cleanup.load_sessions(leases)
+
+    assert set(sessions) == {"a", "b"}
+    assert sessions["a"] == {"expires_at_epoch": 100, "voice_ids": ["va"], "sample_sha256": DIGEST}
+
+
+def test_cleanup_keeps_the_lease_when_a_deletion_fails(leases):
+    put_lease(leases, "a", "va", 100)
+    sessions = voice_cleanup.load_sessions(leases)
+
+    client = FakeClient(fail={"va"})
+    assert not voice_cleanup.cleanup_session(client, leases, "a", sessions["a"])
+    assert "Item" in leases.get_item(Key={"session_id": "a"})
+
+    client = FakeClient()
+    assert voice_cleanup.cleanup_session(client, leases, "a", sessions["a"])
+    assert client.voices.deleted == ["va"]
+    assert "Item" not in leases.get_item(Key={"session_id": "a"})
+
+
+def test_cleanup_keeps_a_voice_another_session_uses(leases):
+    voice_index.register(leases, DIGEST, "v")
+    voice_index.acquire(leases, DIGEST, "v")
+    put_lease(leases, "a", "v", 100, sample_sha256=DIGEST)
+    put_lease(leases, "b", "v", 900, sample_sha256=DIGEST)
+    sessions = voice_cleanup.load_sessions(leases)
+    client = FakeClient()
+
+    assert voice_cleanup.cleanup_session(client, leases, "a", sessions["a"])
+    assert client.voices.deleted == []
+    # cleaning the same lease again (the index lagged) must not release twice
+    assert voice_cleanup.cleanup_session(client, leases, "a", sessions["a"])
+    assert voice_cleanup.cleanup_session(client, leases, "b", sessions["b"])
+    assert client.voices.deleted == ["v"]
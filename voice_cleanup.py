@@ -1,35 +1,164 @@
-import json, time, os
+import heapq, time, os, sys
+from typing import Dict, List, Optional, Tuple
+import boto3
+from boto3.dynamodb.conditions import Key
 from elevenlabs import ElevenLabs
+from elevenlabs.core import ApiError
 from dotenv import load_dotenv
 
+# voice_index is shared with the cleanup Lambda (membox/membox)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "membox", "membox"))
+import voice_index
+
 load_dotenv()
-TIMEOUT = 10 * 60
+LEASES_TABLE = os.getenv("LEASES_TABLE", "leases")
+# Point at DynamoDB Local (e.g. http://localhost:8000) to run against local tables
+DDB_ENDPOINT_URL = os.getenv("DYNAMODB_ENDPOINT_URL") or None
+LEASE_INDEX = "by_status"
+LEASE_STATUSES = ("active", "ended", "expired", "speculative")
+WATCH_INTERVAL = 2  # seconds between polls of the leases index for lease changes
+RETRY_DELAY = 30  # seconds before a session whose voice deletion failed is retried
+
+# Sessions are the app's lease rows: each is due at its expires_at_epoch, and
+# its el_voice_id is deleted then, unless another session with the same
+# sample (sample_sha256) still holds a reference to it.
+
+
+def _as_list(x) -> List[str]:
+    if not x:
+        return []
+    return [x] if isinstance(x, str) else [str(i) for i in x]
+
+
+def load_sessions(table) -> Dict[str, dict]:
+    """Every lease still to be cleaned, from the by_status index."""
+    sessions = {}
+    for status in LEASE_STATUSES:
+        kwargs = {"IndexName": LEASE_INDEX, "KeyConditionExpression": Key("status").eq(status)}
+        while True:
+            resp = table.query(**kwargs)
+            for item in resp["Items"]:
+                sessions[item["session_id"]] = {
+                    "expires_at_epoch": item.get("expires_at_epoch"),
+                    "voice_ids": _as_list(item.get("el_voice_id")),
+                    "sample_sha256": item.get("sample_sha256"),
+                }
+            if "LastEvaluatedKey" not in resp:
+                break
+            kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+    return sessions
+
+
+class DeadlineQueue:
+    """Min-heap of session deadlines with lazy invalidation of stale entries."""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self.deadlines: Dict[str, float] = {}
+        self.sessions: Dict[str, dict] = {}
+        self.retry_at: Dict[str, float] = {}
+
+    def sync(self, sessions: Dict[str, dict]):
+        """Apply lease changes: new/extended sessions are (re)queued, gone ones dropped."""
+        for sid in set(self.sessions) - set(sessions):
+            self.deadlines.pop(sid, None)
+            self.sessions.pop(sid, None)
+            self.retry_at.pop(sid, None)
+        for sid, s in sessions.items():
+            try:
+                deadline = float(s["expires_at_epoch"])
+            except (KeyError, TypeError, ValueError):
+                print(f"⚠️ Skipping malformed lease {sid!r}: {s!r}")
+                continue
+            self.sessions[sid] = s
+            self._schedule(sid, max(deadline, self.retry_at.get(sid, 0.0)))
+
+    def retry(self, sid: str, at: float):
+        """Queue an expired session again at ``at`` (its cleanup failed)."""
+        self.retry_at[sid] = at
+        self._schedule(sid, at)
 
+    def _schedule(self, sid: str, deadline: float):
+        if self.deadlines.get(sid) != deadline:
+            self.deadlines[sid] = deadline
+            heapq.heappush(self._heap, (deadline, sid))
 
-def should_cleanup():
+    def _drop_stale(self):
+        while self._heap and self.deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_deadline(self) -> Optional[float]:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now: float) -> List[str]:
+        expired = []
+        while (deadline := self.next_deadline()) is not None and deadline <= now:
+            _, sid = heapq.heappop(self._heap)
+            del self.deadlines[sid]
+            expired.append(sid)
+        return expired
+
+
+def delete_voice(client: ElevenLabs, vid: str) -> bool:
     try:
-        with open("session_state.json") as f:
-            data = json.load(f)
-        return (time.time() - data["last_activity"]) > TIMEOUT
-    except:
+        client.voices.delete(voice_id=vid)
+        print(f"✅ Deleted {vid}")
+    except ApiError as e:
+        if e.status_code != 404:
+            print(f"❌ Failed {vid}: {e}")
+            return False
+        print(f"✅ {vid} was already deleted")
+    except Exception as e:
+        print(f"❌ Failed {vid}: {e}")
         return False
+    return True
+
 
+def cleanup_session(client: ElevenLabs, table, sid: str, session: dict) -> bool:
+    """
+    Delete the session's voices that no other session uses, then its lease.
+    Returns False (lease kept) if a deletion failed.
+    """
+    # the index lags the table: a lease cleaned a moment ago may still be listed
+    if "Item" not in table.get_item(Key={"session_id": sid}, ConsistentRead=True):
+        return True
+    ok = True
+    for vid in session["voice_ids"]:
+        sha = session.get("sample_sha256")
+        if sha and not voice_index.release(table, sha, vid):
+            print(f"🔗 {vid} is still used by another session; kept")
+            continue
+        ok = delete_voice(client, vid) and ok
+    if ok:
+        table.delete_item(Key={"session_id": sid})
+    return ok
 
-def delete_voice():
+
+def watch():
+    """Delete each session's voices as soon as its lease expires."""
     client = ElevenLabs(api_key=os.getenv("ELEVEN_API_KEY"))
-    voices = client.voices.get_all().voices
-    for v in voices:
-        try:
-            client.voices.delete(voice_id=v.voice_id)
-            print(f"✅ Deleted {v.voice_id}")
-        except Exception as e:
-            print(f"❌ Failed {v.voice_id}: {e}")
+    table = boto3.resource("dynamodb", endpoint_url=DDB_ENDPOINT_URL).Table(LEASES_TABLE)
+    queue = DeadlineQueue()
+    while True:
+        queue.sync(load_sessions(table))
+
+        for sid in queue.pop_expired(time.time()):
+            session = queue.sessions[sid]
+            print(f"⏰ Cleaning up expired session {sid}...")
+            if not session["voice_ids"]:
+                print(f"⚠️ No voice recorded for session {sid}; nothing deleted")
+            if cleanup_session(client, table, sid, session):
+                queue.retry_at.pop(sid, None)
+            else:
+                print(f"↩️ Retrying session {sid} in {RETRY_DELAY}s")
+                queue.retry(sid, time.time() + RETRY_DELAY)
+
+        # Sleep until the next deadline, waking briefly to notice lease changes
+        deadline = queue.next_deadline()
+        wait = WATCH_INTERVAL if deadline is None else deadline - time.time()
+        time.sleep(max(0.0, min(wait, WATCH_INTERVAL)))
 
 
 if __name__ == "__main__":
-    while True:
-        if should_cleanup():
-            print("⏰ Cleaning up inactive session...")
-            delete_voice()
-            os.remove("session_state.json")  # optional
-        time.sleep(30)  # check every 30s
+    watch()